@@ -6,6 +6,7 @@ from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import RunReportRequest, DateRange, Metric
+from sheet_helpers import open_worksheet, load_date_row_index, append_date_row
 
 # Setup the Sheets and GA4 Data API
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/analytics']
@@ -47,19 +48,17 @@ def col_num_to_letter(col_num):
 
 def update_sheet_with_data(gc, sheet_id, data_difference, sheet_name):
     """Updates the specified Google Sheet with the data difference by country."""
-    worksheet = gc.open_by_key(sheet_id).worksheet(sheet_name)
+    worksheet = open_worksheet(gc, sheet_id, sheet_name)
 
     # Get current date (as of UTC)
     current_date = (datetime.utcnow() - timedelta(days=1)).strftime('%Y-%m-%d')
 
     # Find a row that matches the date
-    try:
-        date_cell = worksheet.find(current_date, in_column=1)
-        row = date_cell.row
-    except gspread.exceptions.CellNotFound:
+    date_row_index = load_date_row_index(worksheet)
+    row = date_row_index.get(current_date)
+    if row is None:
         # If there is no date, add a new row
-        row = len(worksheet.col_values(1)) + 1
-        worksheet.update_cell(row, 1, current_date)
+        row = append_date_row(worksheet, date_row_index, current_date)
 
     # Get all country names in one request
     countries_in_sheet = worksheet.batch_get(['D1:BP1'])[0][0]
@@ -153,4 +152,3 @@ if __name__ == '__main__':
 
     update_analytics_data_in_sheets(MockRequest())
 
-
@@ -4,6 +4,7 @@ from google.oauth2.service_account import Credentials
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import RunReportRequest, DateRange, Metric
 from datetime import datetime, timedelta
+from sheet_helpers import open_worksheet, load_date_row_index, append_date_row
 
 # Setup the Sheets and GA4 Data API
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/analytics']
@@ -43,20 +44,18 @@ def update_sheet(gc, sheet_id, date_str, data):
         print("No data to update.")
         return
 
-    worksheet = gc.open_by_key(sheet_id).worksheet('Somaz_Community')
+    worksheet = open_worksheet(gc, sheet_id, 'Somaz_Community')
 
-    # Find the cell with yesterday's date or append it if not found
-    try:
-        cell = worksheet.find(date_str)
-    except gspread.exceptions.CellNotFound:
-        next_row = len(worksheet.col_values(1)) + 1
-        worksheet.update_cell(next_row, 1, date_str)
-        cell = gspread.models.Cell(next_row, 1, value=date_str)
+    # Find the row with yesterday's date or append it if not found
+    date_row_index = load_date_row_index(worksheet)
+    row = date_row_index.get(date_str)
+    if row is None:
+        row = append_date_row(worksheet, date_row_index, date_str)
 
     # Update the cell with new data and center-align it
-    worksheet.update_cell(cell.row, 8, data)
+    worksheet.update_cell(row, 8, data)
     # Set the format for the cell
-    worksheet.format(f'H{cell.row}', {
+    worksheet.format(f'H{row}', {
         "horizontalAlignment": "CENTER"
     })
 
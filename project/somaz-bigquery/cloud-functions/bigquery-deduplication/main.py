@@ -1,5 +1,13 @@
 import os
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+
+# Days of partitions rebuilt in the parsed event table after each load, on top of the current month
+PARSED_EVENTS_REFRESH_DAYS = int(os.environ.get('PARSED_EVENTS_REFRESH_DAYS', '3'))
+
+# Raw Mongo log columns copied into the parsed event table. Listed explicitly so a new column in the
+# raw table doesn't break the refresh INSERT; add a column here (and to the table) when a query needs it.
+PARSED_EVENTS_COLUMNS = ['_id', 'timestamp', 'time', 'nid', 'reason', 'collectionName', 'contents']
 
 def remove_duplicates(request):
     # Initialize Bigquery Client
@@ -26,4 +34,65 @@ def remove_duplicates(request):
     # Wait for completion
     query_job.result()
 
+    # Keep the parsed event table in step with the deduplicated load
+    refresh_parsed_events(client, PROJECT_ID, database)
+
     return 'Duplicates have been removed.'
+
+def refresh_parsed_events(client, project_id, database):
+    """
+    Maintain `{database}-mongodb-parsed-events`: the raw Mongo log rows with `time` parsed once into
+    event_time/event_date, partitioned by event_date and clustered by (reason, collectionName).
+    The first run copies all history; later runs rebuild the partitions from the last day of the previous
+    month on, the window the month-to-date sheet queries read, or the last PARSED_EVENTS_REFRESH_DAYS days
+    if that reaches further back.
+    """
+    source_table = f"{project_id}.mongodb_dataset.{database}-mongodb-internal-table"
+    parsed_table = f"{project_id}.mongodb_dataset.{database}-mongodb-parsed-events"
+    column_list = ', '.join(PARSED_EVENTS_COLUMNS)
+    parsed_select = f"""
+      SELECT
+        {', '.join(f'raw.{column}' for column in PARSED_EVENTS_COLUMNS)},
+        SAFE.PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', raw.time) AS event_time,
+        DATE(SAFE.PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', raw.time)) AS event_date
+      FROM
+        `{source_table}` AS raw
+    """
+
+    try:
+        client.get_table(parsed_table)
+    except NotFound:
+        query = f"""
+        CREATE TABLE `{parsed_table}`
+        PARTITION BY event_date
+        CLUSTER BY reason, collectionName
+        AS
+        {parsed_select}
+        """
+        client.query(query).result()
+        print(f"Created {parsed_table} from the full history of {source_table}")
+        return
+
+    # Replace the recent partitions in one transaction so readers never see them half rebuilt
+    query = f"""
+    DECLARE refresh_from DATE DEFAULT LEAST(
+      DATE_SUB(DATE_TRUNC(CURRENT_DATE(), MONTH), INTERVAL 1 DAY),
+      DATE_SUB(CURRENT_DATE(), INTERVAL @refresh_days DAY)
+    );
+
+    BEGIN TRANSACTION;
+
+    DELETE FROM `{parsed_table}`
+    WHERE event_date >= refresh_from;
+
+    INSERT INTO `{parsed_table}` ({column_list}, event_time, event_date)
+    SELECT * FROM ({parsed_select})
+    WHERE event_date >= refresh_from;
+
+    COMMIT TRANSACTION;
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('refresh_days', 'INT64', PARSED_EVENTS_REFRESH_DAYS)
+    ])
+    client.query(query, job_config=job_config).result()
+    print(f"Refreshed the current month and the last {PARSED_EVENTS_REFRESH_DAYS} days of {parsed_table}")
@@ -1,14 +1,22 @@
+import time
+_module_load_started = time.perf_counter()
+
 import os
 import gspread
+from gspread.utils import a1_to_rowcol
 from google.cloud import bigquery
 from google.oauth2.service_account import Credentials
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-import time
+from query_templates import default_date_window, render_query
+from sheet_helpers import open_worksheet, load_date_row_index, build_value_blocks, flush_sheet_writes
+from query_budget import run_query
 
 def update_multiple_datas_in_sheets(request):
     try:
         logging.info("Starting update_multiple_datas_in_sheets function")
+        log_cold_start()
 
         # BigQuery setup
         client = bigquery.Client()
@@ -19,118 +27,133 @@ def update_multiple_datas_in_sheets(request):
         logging.info("Connected to Google Sheets")
 
         # Open Google Sheets document
-        sh = gc.open_by_key(os.getenv('SHEET_ID'))
-        worksheet = sh.worksheet('Somaz_Table')  # Replace 'Somaz_Table' with your actual sheet name
+        worksheet = open_worksheet(gc, os.getenv('SHEET_ID'), 'Somaz_Table')  # Replace 'Somaz_Table' with your actual sheet name
         yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
 
-        # Execute and update for each query
-        execute_and_update_for_query(client, worksheet, yesterday, complex_query_1(client), get_complex_query_1_mapping())
-        time.sleep(10)
-        execute_and_update_for_query(client, worksheet, yesterday, complex_query_2(client), get_complex_query_2_mapping())
-        time.sleep(10)
-        execute_and_update_for_query(client, worksheet, yesterday, complex_query_3(client), get_complex_query_3_mapping())
-        time.sleep(10)
-        execute_and_update_for_query(client, worksheet, yesterday, complex_query_4(client), get_complex_query_4_mapping())
-        time.sleep(10)
-        execute_and_update_for_query(client, worksheet, yesterday, complex_query_5(client), get_complex_query_5_mapping())
+        # Read the date column once and reuse it for every item lookup
+        date_row_index = load_date_row_index(worksheet)
+
+        # A start_date/end_date pair in the request backfills that range instead of yesterday
+        backfill_window = get_backfill_window(request)
+        if backfill_window:
+            date_window = backfill_window
+            start_date, end_date = backfill_window
+            dates = [(start_date + timedelta(days=day)).strftime('%Y-%m-%d') for day in range((end_date - start_date).days + 1)]
+        else:
+            date_window = default_date_window()
+            dates = [yesterday]
+
+        # Look every date up once; a date missing from the sheet is logged here instead of once per item
+        date_rows = {date: date_row_index[date] for date in dates if date in date_row_index}
+        missing_dates = [date for date in dates if date not in date_row_index]
+        if missing_dates:
+            logging.warning(f"Dates not found in the sheet: {', '.join(missing_dates)}")
+        if not date_rows:
+            return f"Dates not found in the sheet: {', '.join(missing_dates)}", 200
+
+        # Dry-run, submit and fetch every query in its own thread so the budget checks don't serialize the jobs
+        queries = [
+            ('complex_query_1', get_complex_query_1_mapping()),
+            ('complex_query_2', get_complex_query_2_mapping()),
+            ('complex_query_3', get_complex_query_3_mapping()),
+            ('complex_query_4', get_complex_query_4_mapping()),
+            ('complex_query_5', get_complex_query_5_mapping()),
+        ]
+
+        # A daily run updates the sheet as soon as each result arrives; a backfill writes every query in one pass
+        value_updates = []
+        cell_formats = []
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            futures = {executor.submit(submit_and_fetch_query, client, query_id, date_window): column_mapping for query_id, column_mapping in queries}
+            for future in as_completed(futures):
+                execute_and_update_for_query(worksheet, date_rows, future.result(), futures[future], value_updates, cell_formats)
+                if not backfill_window:
+                    flush_value_updates(worksheet, value_updates, cell_formats)
+        flush_value_updates(worksheet, value_updates, cell_formats)
 
         # Add additional query executions here
 
+        if backfill_window:
+            message = f"Backfilled {len(date_rows)} dates from {dates[0]} to {dates[-1]}"
+            logging.info(message)
+            return message, 200
+
         logging.info("Data from multiple queries updated in Google Sheets for yesterday!")
         return "Data from multiple queries updated in Google Sheets for yesterday!", 200
     except Exception as e:
         logging.error(f"Error occurred: {e}")
         return f"An error occurred: {e}", 500
 
-def execute_and_update_for_query(client, worksheet, date, query, column_mapping):
-    results = query
-    for item_name, column in column_mapping.items():
-        update_sheet_for_item(worksheet, results, item_name, column, date)
-
-def update_sheet_for_item(worksheet, results, item_name, column, date):
-    try:
-        date_cell = worksheet.find(date)
-        cell = f'{column}{date_cell.row}'
-
-        if 'itemName' in results.columns:
-            # This branch handles the structure from complex_query_1
-            item_data = results[results['itemName'] == item_name]
-            date_data = int(item_data['dates'].apply(lambda x: next((d['quantity'] for d in x if d['date'] == date), 0)).iloc[0]) if not item_data.empty else 0
-        else:
-            # This branch handles the structure from complex_query_2
-            date_data = int(results[results['date'] == date][item_name].iloc[0]) if not results[results['date'] == date].empty else 0
-
-        worksheet.update_acell(cell, date_data)
-        worksheet.format(cell, {"horizontalAlignment": "CENTER"})
-    except gspread.exceptions.CellNotFound:
-        logging.warning(f"Date {date} not found in the sheet for item {item_name}.")
-
-
-def complex_query_1(client):
-    # Define and execute the complex query
-    complex_query_1 = """
-    WITH ParsedData AS (
-        SELECT
-            PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS time,
-            CAST (JSON_EXTRACT_SCALAR(contents, '$.reward.dataId') AS INT64) AS dataId,
-            CAST (JSON_EXTRACT_SCALAR(contents, '$.reward.quantity') AS INT64) AS quantity
-        FROM
-            `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-        WHERE
-            reason = '/arena/season-shop/buy'
-            AND collectionName IN UNNEST(["payment_material", "payment_hero_gacha"])
-            AND (
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-                OR
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-            )
-    ),
-    ProcessedData AS (
-        SELECT
-            FORMAT_DATE('%Y-%m-%d', time) AS date,
-            CASE
-                WHEN dataId = 400000 THEN '스피릿 링크'
-                WHEN dataId = 400001 THEN '파라도스 에일'
-
-                WHEN dataId = 451000 THEN '하급 화염 승급서'
-                WHEN dataId = 451010 THEN '하급 냉기 승급서'
-                WHEN dataId = 451020 THEN '하급 자연 승급서'
-                WHEN dataId = 451030 THEN '하급 기계 승급서'
-                WHEN dataId = 451040 THEN '하급 빛 승급서'
-                WHEN dataId = 451050 THEN '하급 암흑 승급서'
-
-                WHEN dataId = 451001 THEN '중급 화염 승급서'
-                WHEN dataId = 451011 THEN '중급 냉기 승급서'
-                WHEN dataId = 451021 THEN '중급 자연 승급서'
-                WHEN dataId = 451031 THEN '중급 기계 승급서'
-                WHEN dataId = 451041 THEN '중급 빛 승급서'
-                WHEN dataId = 451051 THEN '중급 암흑 승급서'
-
-                WHEN dataId = 451100 THEN '차원의 시계'
-                WHEN dataId = 454001 THEN '염색약'
-
-                ELSE 'Unknown Item'
-            END AS itemName,
-            quantity
-        FROM ParsedData
-    ),
-    AggregatedData AS (
-        SELECT
-            itemName,
-            date,
-            SUM(quantity) AS quantity
-        FROM ProcessedData
-        GROUP BY itemName, date
-    )
-    SELECT
-        itemName,
-        ARRAY_AGG(STRUCT(date, quantity) ORDER BY date) AS dates,
-        SUM(quantity) AS totalQuantity
-    FROM AggregatedData
-    GROUP BY itemName
-    ORDER BY itemName;
-    """
-    return client.query(complex_query_1).result().to_dataframe()
+_cold_start_pending = True
+
+def log_cold_start():
+    """Log how long the module imports took, once per instance."""
+    global _cold_start_pending
+    if _cold_start_pending:
+        logging.info(f"Cold start: module loaded in {MODULE_LOAD_SECONDS:.3f}s")
+        _cold_start_pending = False
+
+def fetch_query_rows(query_job):
+    """Wait for a submitted query job and return its rows as plain dicts, without going through pandas."""
+    rows = [dict(row.items()) for row in query_job.result()]
+    logging.info(f"Query job {query_job.job_id} finished with {len(rows)} rows")
+    return rows
+
+def get_backfill_window(request):
+    """Read an optional start_date/end_date pair (YYYY-MM-DD) from the query string or JSON body."""
+    if request is None:
+        return None
+    params = dict(request.args or {})
+    params.update(request.get_json(silent=True) or {})
+    if not params.get('start_date') and not params.get('end_date'):
+        return None
+    if not params.get('start_date') or not params.get('end_date'):
+        raise ValueError("A backfill needs both start_date and end_date")
+
+    start_date = datetime.strptime(params['start_date'], '%Y-%m-%d').date()
+    end_date = datetime.strptime(params['end_date'], '%Y-%m-%d').date()
+    if end_date < start_date:
+        raise ValueError(f"Backfill end_date {end_date} is before start_date {start_date}")
+    return start_date, end_date
+
+def execute_and_update_for_query(worksheet, date_rows, results, column_mapping, value_updates, cell_formats):
+    for date, date_row in date_rows.items():
+        for item_name, column in column_mapping.items():
+            update_sheet_for_item(worksheet, date_row, results, item_name, column, date, value_updates, cell_formats)
+
+def flush_value_updates(worksheet, value_updates, cell_formats):
+    """Write the collected cells as merged ranges, with their formats, and empty both lists."""
+    if not value_updates:
+        return
+    cell_values = {tuple(a1_to_rowcol(update['range'])): update['values'][0][0] for update in value_updates}
+    flush_sheet_writes(worksheet, build_value_blocks(cell_values), cell_formats)
+    logging.info(f"Wrote {len(value_updates)} cells in one batch")
+    del value_updates[:]
+    del cell_formats[:]
+
+def update_sheet_for_item(worksheet, date_row, results, item_name, column, date, value_updates, cell_formats):
+    cell = f'{column}{date_row}'
+
+    if results and 'itemName' in results[0]:
+        # This branch handles the structure from complex_query_1
+        item_data = next((row for row in results if row['itemName'] == item_name), None)
+        date_data = int(next((d['quantity'] for d in item_data['dates'] if d['date'] == date), 0) or 0) if item_data else 0
+    else:
+        # This branch handles the structure from complex_query_2
+        date_data = next((row for row in results if row['date'] == date), None)
+        date_data = int(date_data[item_name] or 0) if date_data else 0
+
+    value_updates.append({'range': cell, 'values': [[date_data]]})
+    cell_formats.append((date_row, a1_to_rowcol(cell)[1], {"horizontalAlignment": "CENTER"}))
+
+def submit_query(client, query_id, date_window):
+    """Render a query template for the date window and submit it through the budget guard."""
+    sql, job_config = render_query(query_id, *date_window)
+    return run_query(client, query_id, sql, job_config)
+
+def submit_and_fetch_query(client, query_id, date_window):
+    """Submit a query through the budget guard and wait for its rows."""
+    return fetch_query_rows(submit_query(client, query_id, date_window))
 
 def get_complex_query_1_mapping():
     # Map each item to its corresponding column in the sheet
@@ -155,65 +178,6 @@ def get_complex_query_1_mapping():
         # ... Add mappings for other items ...
     }
 
-
-def complex_query_2(client):
-
-    complex_query_2 = """
-    WITH ParsedData AS (
-        SELECT
-            PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS time,
-            JSON_EXTRACT_ARRAY(contents, '$.createCharacter') AS createCharacterArray,
-            CAST(JSON_EXTRACT_SCALAR(contents, '$.usedGoods[0].id') AS INT64) AS id
-        FROM
-            `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-        WHERE
-            reason = '/inventory/pack/reveal'
-            AND collectionName IN UNNEST(["reveal_hero_gacha_pack"])
-            AND (
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-                OR
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-            )
-    ),
-    UnwoundData AS (
-        SELECT
-            time,
-            id,
-            JSON_EXTRACT_SCALAR(char, '$.actorId') AS actorId
-        FROM
-            ParsedData
-        CROSS JOIN
-            UNNEST(createCharacterArray) AS char
-    ),
-    AggregatedData AS (
-        SELECT
-            FORMAT_DATE('%Y-%m-%d', time) AS date,
-            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 105001 AND 106000 THEN 1 ELSE 0 END) AS `커먼`,
-            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 104001 AND 105000 THEN 1 ELSE 0 END) AS `언커먼`,
-            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 103001 AND 104000 THEN 1 ELSE 0 END) AS `레어`,
-            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 102001 AND 103000 THEN 1 ELSE 0 END) AS `에픽`,
-            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 101001 AND 102000 THEN 1 ELSE 0 END) AS `레전드`
-        FROM
-            UnwoundData
-        WHERE
-            id IN (3400004, 3400005, 3400006, 3400007, 3400008)
-        GROUP BY
-            date
-    )
-    SELECT
-        date,
-        `커먼`,
-        `언커먼`,
-        `레어`,
-        `에픽`,
-        `레전드`
-    FROM
-        AggregatedData
-    ORDER BY
-        date;
-    """
-    return client.query(complex_query_2).result().to_dataframe()    
-
 def get_complex_query_2_mapping():
     # Map each item to its corresponding column in the sheet
     return {
@@ -226,41 +190,6 @@ def get_complex_query_2_mapping():
         # ... Add mappings for other items ...
     }
 
-
-def complex_query_3(client):
-    complex_query_3 = """
-    WITH ParsedData AS (
-        SELECT
-            FORMAT_DATE('%Y-%m-%d', PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) AS date,
-            CAST(JSON_EXTRACT_SCALAR(contents, '$.reward.dataId') AS INT64) AS dataId,
-            CAST(JSON_EXTRACT_SCALAR(contents, '$.reward.quantity') AS INT64) AS quantity
-        FROM
-            `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-        WHERE
-            reason = '/character/breeding'
-            AND collectionName IN UNNEST(["payment_character"])
-            AND (
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-                OR
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-            )
-    )
-    SELECT
-        date,
-        SUM(CASE WHEN dataId BETWEEN 105001 AND 106000 THEN quantity ELSE 0 END) AS `커먼`,
-        SUM(CASE WHEN dataId BETWEEN 104001 AND 105000 THEN quantity ELSE 0 END) AS `언커먼`,
-        SUM(CASE WHEN dataId BETWEEN 103001 AND 104000 THEN quantity ELSE 0 END) AS `레어`,
-        SUM(CASE WHEN dataId BETWEEN 102001 AND 103000 THEN quantity ELSE 0 END) AS `에픽`,
-        SUM(CASE WHEN dataId BETWEEN 101001 AND 102000 THEN quantity ELSE 0 END) AS `레전더리`
-    FROM
-        ParsedData
-    GROUP BY
-        date
-    ORDER BY
-        date;
-    """
-    return client.query(complex_query_3).result().to_dataframe()
-
 def get_complex_query_3_mapping():
     return {
         "커먼": "AR",
@@ -270,40 +199,6 @@ def get_complex_query_3_mapping():
         "레전더리": "AV"
     }
 
-
-def complex_query_4(client):
-    complex_query_4 = """
-    WITH ParsedData AS (
-        SELECT
-            FORMAT_DATE('%Y-%m-%d', PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) AS date,
-            CAST(JSON_EXTRACT_SCALAR(contents, '$.usedCharacter.actorId') AS INT64) AS dataId
-        FROM
-            `mgmt-2023.mongodb_dataset.production-mongodb-internal-table`
-        WHERE
-            reason = '/character/gradeup'
-            AND collectionName IN UNNEST(["consume_character"])
-            AND (
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-                OR
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-            )
-    )
-    SELECT
-        date,
-        SUM(CASE WHEN dataId BETWEEN 105001 AND 106000 THEN 1 ELSE 0 END) AS `커먼`,
-        SUM(CASE WHEN dataId BETWEEN 104001 AND 105000 THEN 1 ELSE 0 END) AS `언커먼`,
-        SUM(CASE WHEN dataId BETWEEN 103001 AND 104000 THEN 1 ELSE 0 END) AS `레어`,
-        SUM(CASE WHEN dataId BETWEEN 102001 AND 103000 THEN 1 ELSE 0 END) AS `에픽`,
-        SUM(CASE WHEN dataId BETWEEN 101001 AND 102000 THEN 1 ELSE 0 END) AS `레전드`
-    FROM
-        ParsedData
-    GROUP BY
-        date
-    ORDER BY
-        date;
-    """
-    return client.query(complex_query_4).result().to_dataframe()
-
 def get_complex_query_4_mapping():
     return {
         "커먼": "BL",
@@ -313,40 +208,6 @@ def get_complex_query_4_mapping():
         "레전드": "BP"
     }
 
-
-def complex_query_5(client):
-    complex_query_5 = """
-    WITH ParsedData AS (
-        SELECT
-            FORMAT_DATE('%Y-%m-%d', PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) AS date,
-            CAST(JSON_EXTRACT_SCALAR(contents, '$.usedCharacter.actorId') AS INT64) AS dataId
-        FROM
-            `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-        WHERE
-            reason = '/character/level/up'
-            AND collectionName IN UNNEST(["consume_character"])
-            AND (
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-                OR
-                CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-            )
-    )
-    SELECT
-        date,
-        SUM(CASE WHEN dataId BETWEEN 105001 AND 106000 THEN 1 ELSE 0 END) AS `커먼`,
-        SUM(CASE WHEN dataId BETWEEN 104001 AND 105000 THEN 1 ELSE 0 END) AS `언커먼`,
-        SUM(CASE WHEN dataId BETWEEN 103001 AND 104000 THEN 1 ELSE 0 END) AS `레어`,
-        SUM(CASE WHEN dataId BETWEEN 102001 AND 103000 THEN 1 ELSE 0 END) AS `에픽`,
-        SUM(CASE WHEN dataId BETWEEN 101001 AND 102000 THEN 1 ELSE 0 END) AS `레전드`
-    FROM
-        ParsedData
-    GROUP BY
-        date
-    ORDER BY
-        date;
-    """
-    return client.query(complex_query_5).result().to_dataframe()
-
 def get_complex_query_5_mapping():
     return {
         "커먼": "BQ",
@@ -356,6 +217,7 @@ def get_complex_query_5_mapping():
         "레전드": "BU"
     }
 
+MODULE_LOAD_SECONDS = time.perf_counter() - _module_load_started
 
 if __name__ == "__main__":
     update_multiple_datas_in_sheets(None)
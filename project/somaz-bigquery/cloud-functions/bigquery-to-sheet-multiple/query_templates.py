@@ -0,0 +1,229 @@
+"""
+Parameterized SQL for the bigquery-to-sheet-multiple queries.
+
+Each query reads its window from the typed @start_date and @end_date parameters, so the
+SQL text stays the same from run to run and BigQuery can serve repeats from its result cache.
+"""
+from datetime import date, timedelta
+from google.cloud import bigquery
+
+def default_date_window(today=None):
+    """The window of the daily run: the last day of the previous month through today."""
+    today = today or date.today()
+    return today.replace(day=1) - timedelta(days=1), today
+
+def date_window_job_config(start_date, end_date):
+    """Build a job config that binds @start_date and @end_date as DATE parameters."""
+    return bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('start_date', 'DATE', start_date),
+        bigquery.ScalarQueryParameter('end_date', 'DATE', end_date),
+    ])
+
+def render_query(query_id, start_date, end_date):
+    """Return the SQL of a query and the job config that binds its date window."""
+    return QUERY_TEMPLATES[query_id], date_window_job_config(start_date, end_date)
+
+# Arena season shop purchases per item, with the daily quantities of each item
+COMPLEX_QUERY_1 = """
+    WITH ParsedData AS (
+        SELECT
+            event_time AS time,
+            CAST (JSON_EXTRACT_SCALAR(contents, '$.reward.dataId') AS INT64) AS dataId,
+            CAST (JSON_EXTRACT_SCALAR(contents, '$.reward.quantity') AS INT64) AS quantity
+        FROM
+            `somaz-bigquery.mongodb_dataset.production-mongodb-parsed-events`
+        WHERE
+            reason = '/arena/season-shop/buy'
+            AND collectionName IN UNNEST(["payment_material", "payment_hero_gacha"])
+            AND event_date BETWEEN @start_date AND @end_date
+    ),
+    ProcessedData AS (
+        SELECT
+            FORMAT_DATE('%Y-%m-%d', time) AS date,
+            CASE
+                WHEN dataId = 400000 THEN '스피릿 링크'
+                WHEN dataId = 400001 THEN '파라도스 에일'
+
+                WHEN dataId = 451000 THEN '하급 화염 승급서'
+                WHEN dataId = 451010 THEN '하급 냉기 승급서'
+                WHEN dataId = 451020 THEN '하급 자연 승급서'
+                WHEN dataId = 451030 THEN '하급 기계 승급서'
+                WHEN dataId = 451040 THEN '하급 빛 승급서'
+                WHEN dataId = 451050 THEN '하급 암흑 승급서'
+
+                WHEN dataId = 451001 THEN '중급 화염 승급서'
+                WHEN dataId = 451011 THEN '중급 냉기 승급서'
+                WHEN dataId = 451021 THEN '중급 자연 승급서'
+                WHEN dataId = 451031 THEN '중급 기계 승급서'
+                WHEN dataId = 451041 THEN '중급 빛 승급서'
+                WHEN dataId = 451051 THEN '중급 암흑 승급서'
+
+                WHEN dataId = 451100 THEN '차원의 시계'
+                WHEN dataId = 454001 THEN '염색약'
+
+                ELSE 'Unknown Item'
+            END AS itemName,
+            quantity
+        FROM ParsedData
+    ),
+    AggregatedData AS (
+        SELECT
+            itemName,
+            date,
+            SUM(quantity) AS quantity
+        FROM ProcessedData
+        GROUP BY itemName, date
+    )
+    SELECT
+        itemName,
+        ARRAY_AGG(STRUCT(date, quantity) ORDER BY date) AS dates,
+        SUM(quantity) AS totalQuantity
+    FROM AggregatedData
+    GROUP BY itemName
+    ORDER BY itemName;
+    """
+
+# Hero gacha pack reveals per date, by rarity of the created characters
+COMPLEX_QUERY_2 = """
+    WITH ParsedData AS (
+        SELECT
+            event_time AS time,
+            JSON_EXTRACT_ARRAY(contents, '$.createCharacter') AS createCharacterArray,
+            CAST(JSON_EXTRACT_SCALAR(contents, '$.usedGoods[0].id') AS INT64) AS id
+        FROM
+            `somaz-bigquery.mongodb_dataset.production-mongodb-parsed-events`
+        WHERE
+            reason = '/inventory/pack/reveal'
+            AND collectionName IN UNNEST(["reveal_hero_gacha_pack"])
+            AND event_date BETWEEN @start_date AND @end_date
+    ),
+    UnwoundData AS (
+        SELECT
+            time,
+            id,
+            JSON_EXTRACT_SCALAR(char, '$.actorId') AS actorId
+        FROM
+            ParsedData
+        CROSS JOIN
+            UNNEST(createCharacterArray) AS char
+    ),
+    AggregatedData AS (
+        SELECT
+            FORMAT_DATE('%Y-%m-%d', time) AS date,
+            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 105001 AND 106000 THEN 1 ELSE 0 END) AS `커먼`,
+            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 104001 AND 105000 THEN 1 ELSE 0 END) AS `언커먼`,
+            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 103001 AND 104000 THEN 1 ELSE 0 END) AS `레어`,
+            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 102001 AND 103000 THEN 1 ELSE 0 END) AS `에픽`,
+            SUM(CASE WHEN CAST(actorId AS INT64) BETWEEN 101001 AND 102000 THEN 1 ELSE 0 END) AS `레전드`
+        FROM
+            UnwoundData
+        WHERE
+            id IN (3400004, 3400005, 3400006, 3400007, 3400008)
+        GROUP BY
+            date
+    )
+    SELECT
+        date,
+        `커먼`,
+        `언커먼`,
+        `레어`,
+        `에픽`,
+        `레전드`
+    FROM
+        AggregatedData
+    ORDER BY
+        date;
+    """
+
+# Breeding rewards per date, by rarity
+COMPLEX_QUERY_3 = """
+    WITH ParsedData AS (
+        SELECT
+            FORMAT_DATE('%Y-%m-%d', event_date) AS date,
+            CAST(JSON_EXTRACT_SCALAR(contents, '$.reward.dataId') AS INT64) AS dataId,
+            CAST(JSON_EXTRACT_SCALAR(contents, '$.reward.quantity') AS INT64) AS quantity
+        FROM
+            `somaz-bigquery.mongodb_dataset.production-mongodb-parsed-events`
+        WHERE
+            reason = '/character/breeding'
+            AND collectionName IN UNNEST(["payment_character"])
+            AND event_date BETWEEN @start_date AND @end_date
+    )
+    SELECT
+        date,
+        SUM(CASE WHEN dataId BETWEEN 105001 AND 106000 THEN quantity ELSE 0 END) AS `커먼`,
+        SUM(CASE WHEN dataId BETWEEN 104001 AND 105000 THEN quantity ELSE 0 END) AS `언커먼`,
+        SUM(CASE WHEN dataId BETWEEN 103001 AND 104000 THEN quantity ELSE 0 END) AS `레어`,
+        SUM(CASE WHEN dataId BETWEEN 102001 AND 103000 THEN quantity ELSE 0 END) AS `에픽`,
+        SUM(CASE WHEN dataId BETWEEN 101001 AND 102000 THEN quantity ELSE 0 END) AS `레전더리`
+    FROM
+        ParsedData
+    GROUP BY
+        date
+    ORDER BY
+        date;
+    """
+
+# Character grade-ups per date, by rarity of the consumed character (raw internal table)
+COMPLEX_QUERY_4 = """
+    WITH ParsedData AS (
+        SELECT
+            FORMAT_DATE('%Y-%m-%d', PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) AS date,
+            CAST(JSON_EXTRACT_SCALAR(contents, '$.usedCharacter.actorId') AS INT64) AS dataId
+        FROM
+            `mgmt-2023.mongodb_dataset.production-mongodb-internal-table`
+        WHERE
+            reason = '/character/gradeup'
+            AND collectionName IN UNNEST(["consume_character"])
+            AND CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN @start_date AND @end_date
+    )
+    SELECT
+        date,
+        SUM(CASE WHEN dataId BETWEEN 105001 AND 106000 THEN 1 ELSE 0 END) AS `커먼`,
+        SUM(CASE WHEN dataId BETWEEN 104001 AND 105000 THEN 1 ELSE 0 END) AS `언커먼`,
+        SUM(CASE WHEN dataId BETWEEN 103001 AND 104000 THEN 1 ELSE 0 END) AS `레어`,
+        SUM(CASE WHEN dataId BETWEEN 102001 AND 103000 THEN 1 ELSE 0 END) AS `에픽`,
+        SUM(CASE WHEN dataId BETWEEN 101001 AND 102000 THEN 1 ELSE 0 END) AS `레전드`
+    FROM
+        ParsedData
+    GROUP BY
+        date
+    ORDER BY
+        date;
+    """
+
+# Character level-ups per date, by rarity of the consumed character
+COMPLEX_QUERY_5 = """
+    WITH ParsedData AS (
+        SELECT
+            FORMAT_DATE('%Y-%m-%d', event_date) AS date,
+            CAST(JSON_EXTRACT_SCALAR(contents, '$.usedCharacter.actorId') AS INT64) AS dataId
+        FROM
+            `somaz-bigquery.mongodb_dataset.production-mongodb-parsed-events`
+        WHERE
+            reason = '/character/level/up'
+            AND collectionName IN UNNEST(["consume_character"])
+            AND event_date BETWEEN @start_date AND @end_date
+    )
+    SELECT
+        date,
+        SUM(CASE WHEN dataId BETWEEN 105001 AND 106000 THEN 1 ELSE 0 END) AS `커먼`,
+        SUM(CASE WHEN dataId BETWEEN 104001 AND 105000 THEN 1 ELSE 0 END) AS `언커먼`,
+        SUM(CASE WHEN dataId BETWEEN 103001 AND 104000 THEN 1 ELSE 0 END) AS `레어`,
+        SUM(CASE WHEN dataId BETWEEN 102001 AND 103000 THEN 1 ELSE 0 END) AS `에픽`,
+        SUM(CASE WHEN dataId BETWEEN 101001 AND 102000 THEN 1 ELSE 0 END) AS `레전드`
+    FROM
+        ParsedData
+    GROUP BY
+        date
+    ORDER BY
+        date;
+    """
+
+QUERY_TEMPLATES = {
+    'complex_query_1': COMPLEX_QUERY_1,
+    'complex_query_2': COMPLEX_QUERY_2,
+    'complex_query_3': COMPLEX_QUERY_3,
+    'complex_query_4': COMPLEX_QUERY_4,
+    'complex_query_5': COMPLEX_QUERY_5,
+}
@@ -1,12 +1,18 @@
 import os
+import io
 import gspread
 import time
+from collections import deque
 import pandas as pd
 import logging
 from google.cloud import bigquery
 from google.oauth2.service_account import Credentials
 from datetime import datetime, timedelta
 from gspread.exceptions import APIError
+import hashlib
+from google.cloud import storage
+from sheet_helpers import open_worksheet, load_date_row_index, drop_unchanged_updates
+from query_budget import run_query
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,15 +26,17 @@ def update_retention_datas_in_sheets(request):
             'https://www.googleapis.com/auth/drive'
         ])
         gc = gspread.authorize(creds)
-        sh = gc.open_by_key(os.getenv('SHEET_ID'))
-        worksheet = sh.worksheet('Somaz_Retention')
-
-        # Execute the complex query
-        query_results = complex_query_1(client)
+        worksheet = open_worksheet(gc, os.getenv('SHEET_ID'), 'Somaz_Retention')
 
         # Filter for the last 30 days
         end_date = datetime.now()
         start_date = end_date - timedelta(days=60)  # Changed from 30 to 60 days
+
+        # Execute the complex query, or reuse its result from an earlier run today
+        _query_cache_stats.update(hits=0, misses=0)
+        query_results = complex_query_1(client, (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+        logging.info(f"Query cache: {_query_cache_stats['hits']} hits, {_query_cache_stats['misses']} misses")
+
         query_results['dt'] = pd.to_datetime(query_results['_ec__9d__bc__ec__9e__90_']).dt.strftime('%Y-%m-%d')
         query_results = query_results[query_results['dt'].between(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))]
 
@@ -48,7 +56,75 @@ def update_retention_datas_in_sheets(request):
         logging.error(f"An error occurred: {e}")
         return f"An error occurred: {e}", 500
 
-def complex_query_1(client):
+def normalize_sql(sql):
+    """Collapse whitespace so formatting-only edits of a query map to the same cache key."""
+    return ' '.join(sql.split())
+
+def query_cache_key(sql, date_window):
+    """Hash the normalized SQL together with the date window its result is used for."""
+    start_date, end_date = date_window
+    return hashlib.sha256(f'{normalize_sql(sql)}\n{start_date}:{end_date}'.encode('utf-8')).hexdigest()
+
+# Hit and miss counts of the query result cache for the current instance
+_query_cache_stats = {'hits': 0, 'misses': 0}
+
+def read_cached_query_result(cache_key, ttl_seconds):
+    """
+    Read a cached query result stored as Parquet, if it is younger than ttl_seconds.
+    QUERY_CACHE_DIR selects a local directory (for tests), QUERY_CACHE_BUCKET a GCS bucket.
+    """
+    cache_dir = os.getenv('QUERY_CACHE_DIR')
+    bucket_name = os.getenv('QUERY_CACHE_BUCKET')
+    try:
+        if cache_dir:
+            path = os.path.join(cache_dir, f'{cache_key}.parquet')
+            if not os.path.exists(path) or time.time() - os.path.getmtime(path) > ttl_seconds:
+                return None
+            return pd.read_parquet(path)
+        if bucket_name:
+            blob = storage.Client().bucket(bucket_name).get_blob(f'query-results/{cache_key}.parquet')
+            if blob is None or datetime.now(blob.updated.tzinfo) - blob.updated > timedelta(seconds=ttl_seconds):
+                return None
+            return pd.read_parquet(io.BytesIO(blob.download_as_bytes()))
+    except Exception as e:
+        logging.warning(f"Could not read cached query result {cache_key}: {e}")
+    return None
+
+def write_cached_query_result(cache_key, results):
+    """Store a query result as Parquet in the configured cache directory or bucket."""
+    cache_dir = os.getenv('QUERY_CACHE_DIR')
+    bucket_name = os.getenv('QUERY_CACHE_BUCKET')
+    try:
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            results.to_parquet(os.path.join(cache_dir, f'{cache_key}.parquet'), index=False)
+        elif bucket_name:
+            buffer = io.BytesIO()
+            results.to_parquet(buffer, index=False)
+            blob = storage.Client().bucket(bucket_name).blob(f'query-results/{cache_key}.parquet')
+            blob.upload_from_string(buffer.getvalue(), content_type='application/octet-stream')
+    except Exception as e:
+        logging.warning(f"Could not write cached query result {cache_key}: {e}")
+
+def cached_query(client, query_name, sql, date_window, ttl_seconds):
+    """Return the result of a query as a dataframe, running it only when no fresh cached copy exists."""
+    cache_key = query_cache_key(sql, date_window)
+    results = read_cached_query_result(cache_key, ttl_seconds)
+    if results is not None:
+        _query_cache_stats['hits'] += 1
+        logging.info(f"Query cache hit for {query_name} ({cache_key[:12]}), {len(results)} rows")
+        return results
+
+    _query_cache_stats['misses'] += 1
+    logging.info(f"Query cache miss for {query_name} ({cache_key[:12]}), running the query")
+    results = run_query(client, query_name, sql).result().to_dataframe()
+    write_cached_query_result(cache_key, results)
+    return results
+
+# The retention cohorts only change once a day, so a retry within the day reuses the result
+COMPLEX_QUERY_1_CACHE_TTL_SECONDS = int(os.getenv('COMPLEX_QUERY_1_CACHE_TTL_SECONDS', 6 * 3600))
+
+def complex_query_1(client, date_window):
     # Define and execute the new query
     complex_query_1 = """
     SELECT * 
@@ -275,13 +351,7 @@ def complex_query_1(client):
         '''
     );
     """
-    return client.query(complex_query_1).result().to_dataframe()
-
-def find_date_cell(worksheet, date):
-    try:
-        return worksheet.find(date)
-    except gspread.exceptions.CellNotFound:
-        return None
+    return cached_query(client, 'complex_query_1', complex_query_1, date_window, COMPLEX_QUERY_1_CACHE_TTL_SECONDS)
 
 def get_excel_column(index):
     # Adjust the index to start from 'GA', which is the 182th column in Excel
@@ -299,49 +369,102 @@ def get_excel_column(index):
         second_letter = chr(65 + second_letter_index)
         return first_letter + second_letter
 
-def update_sheet_with_complex_query_results(worksheet, results):
-    # Initialize a list to keep track of cell updates
-    cell_updates = []
+# D+1 .. D+180 are written to columns GA .. MX
+RETENTION_DAY_COUNT = 180
 
-    # Process each row in the filtered results
+def build_retention_blocks(results, date_row_index):
+    """
+    Map the cohort rows onto contiguous GA:MX blocks of the sheet.
+    Rows whose dates sit next to each other in the sheet share one range.
+    """
+    rows_by_sheet_row = {}
     for index, row in results.iterrows():
-        # Find the cell for the date
-        date_cell = find_date_cell(worksheet, row['dt'])
-        if date_cell:
-            # Prepare the updates for each cell in the row
-            for col_idx, value in enumerate(row[1:], start=2):
-                cell_range = f'{get_excel_column(col_idx)}{date_cell.row}'
-                # Check if the column is beyond the limit of 'MX'
-                if cell_range.startswith('MY'):
-                    break  # Stop if the column exceeds the MX limit
-                cell_updates.append({
-                    'range': cell_range,
-                    'values': [[value]]
-                })
-
-    request_times = []  # Store the times when requests are made
-
-    for i in range(0, len(cell_updates), 30):
-        now = time.time()  # Current time in seconds
-        request_times = [t for t in request_times if now - t < 60]  # Keep only the last minute's requests
-
-        if len(request_times) >= 55:  # If near the limit, wait
-            time_to_wait = 61 - (now - request_times[0])
-            logging.info(f"Approaching quota limit, waiting for {time_to_wait} seconds")
-            time.sleep(time_to_wait)
-            request_times = [t for t in request_times if now - t < 60]
-
-        batch = cell_updates[i:i+30]
+        date_row = date_row_index.get(row['dt'])
+        if date_row:
+            rows_by_sheet_row[date_row] = list(row[1:RETENTION_DAY_COUNT + 1])
+
+    blocks = []
+    for date_row in sorted(rows_by_sheet_row):
+        if blocks and blocks[-1]['end_row'] == date_row - 1:
+            blocks[-1]['end_row'] = date_row
+            blocks[-1]['values'].append(rows_by_sheet_row[date_row])
+        else:
+            blocks.append({'start_row': date_row, 'end_row': date_row, 'values': [rows_by_sheet_row[date_row]]})
+
+    first_column = get_excel_column(2)
+    last_column = get_excel_column(RETENTION_DAY_COUNT + 1)
+    return [
+        {
+            'range': f"{first_column}{block['start_row']}:{last_column}{block['end_row']}",
+            'values': block['values']
+        }
+        for block in blocks
+    ]
+
+def update_sheet_with_complex_query_results(worksheet, results):
+    # Read the date column once instead of searching the sheet per row
+    date_row_index = load_date_row_index(worksheet)
+
+    # One range per run of consecutive date rows instead of one range per cell
+    cell_updates = build_retention_blocks(results, date_row_index)
+    logging.info(f"Writing {len(results)} cohort rows as {len(cell_updates)} block ranges")
+
+    # In diff mode only the cells whose value changed since the last run are sent
+    if cell_updates and os.getenv('SYNC_MODE', 'full') == 'diff':
+        cell_updates, _ = drop_unchanged_updates(worksheet, cell_updates, [])
+        if not cell_updates:
+            return
+
+    write_ranges_adaptively(worksheet, cell_updates)
+
+def is_quota_error(e):
+    """Check whether an APIError is a 429 / quota exceeded response."""
+    return e.response.status_code == 429 or "Quota exceeded" in str(e)
+
+def write_ranges_adaptively(worksheet, cell_updates, initial_batch_size=30, min_batch_size=1,
+                            max_batch_size=500, increase_step=10, max_consecutive_failures=10):
+    """
+    Write value ranges with additive-increase / multiplicative-decrease batch sizing.
+    The batch grows while calls succeed, halves on a quota error, and failed batches
+    are put back at the front of the queue until every range has been written.
+    """
+    pending = deque(cell_updates)
+    batch_size = initial_batch_size
+    wait_time = 1.0
+    consecutive_failures = 0
+    request_count = 0
+    throttled_count = 0
+    start_time = time.time()
+
+    while pending:
+        batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
         try:
             worksheet.batch_update(batch, value_input_option='USER_ENTERED')
-            logging.info(f"Updated cells from {batch[0]['range']} to {batch[-1]['range']}")
-            request_times.append(time.time())  # Log the time of the request
         except APIError as e:
-            if "Quota exceeded" in str(e):
-                logging.info("Quota exceeded, adjusting batch size and retrying")
-                # Implement logic to handle quota exceedance, such as reducing batch size
-            else:
+            if not is_quota_error(e):
                 raise
+            # Re-queue the batch and back off before trying a smaller one
+            pending.extendleft(reversed(batch))
+            throttled_count += 1
+            consecutive_failures += 1
+            if consecutive_failures >= max_consecutive_failures:
+                raise Exception(f"Quota still exceeded after {consecutive_failures} attempts, {len(pending)} ranges not written")
+            batch_size = max(min_batch_size, batch_size // 2)
+            logging.info(f"Quota exceeded, batch size cut to {batch_size}, retrying in {wait_time} seconds")
+            time.sleep(wait_time)
+            wait_time = min(wait_time * 2, 60)
+            continue
+
+        request_count += 1
+        consecutive_failures = 0
+        wait_time = 1.0
+        logging.info(f"Updated cells from {batch[0]['range']} to {batch[-1]['range']}")
+        batch_size = min(max_batch_size, batch_size + increase_step)
+
+    elapsed = time.time() - start_time
+    rate = len(cell_updates) / elapsed if elapsed > 0 else len(cell_updates)
+    logging.info(f"Wrote {len(cell_updates)} ranges in {request_count} requests "
+                 f"({throttled_count} throttled) over {elapsed:.1f}s, {rate:.1f} ranges/s")
 
 if __name__ == "__main__":
     update_retention_datas_in_sheets(None)
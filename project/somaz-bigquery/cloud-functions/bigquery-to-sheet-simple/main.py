@@ -1,13 +1,21 @@
+import time
+_module_load_started = time.perf_counter()
+
 import os
 import gspread
+from gspread.utils import a1_to_rowcol
 from google.cloud import bigquery
 from google.oauth2.service_account import Credentials
 import logging
 from datetime import datetime, timedelta
+from query_templates import default_date_window, render_query
+from sheet_helpers import open_worksheet, load_date_row_index, build_value_blocks, flush_sheet_writes
+from query_budget import run_query
 
 def update_data_in_sheets(request):
     try:
         logging.info("Starting update_data_in_sheets function")
+        log_cold_start()
 
         # BigQuery setup
         client = bigquery.Client()
@@ -20,19 +28,28 @@ def update_data_in_sheets(request):
         logging.info("Connected to Google Sheets")
 
         # Open Google Sheets document
-        sh = gc.open_by_key(os.getenv('SHEET_ID'))
-        worksheet = sh.worksheet('Somaz_Table') # Replace 'Somaz_Table' with your actual sheet name
+        worksheet = open_worksheet(gc, os.getenv('SHEET_ID'), 'Somaz_Table') # Replace 'Somaz_Table' with your actual sheet name
+
+        # A start_date/end_date pair in the request backfills that range instead of yesterday
+        backfill_window = get_backfill_window(request)
+        if backfill_window:
+            return backfill_data_in_sheets(client, worksheet, *backfill_window)
 
         # Determine yesterday's date
         yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
 
-        # Execute queries and update sheet
-        update_sheet_with_query(client, worksheet, nru_query, yesterday, 'B', 'date') # NRU data in column B
-        update_sheet_with_query(client, worksheet, dau_query, yesterday, 'D', 'dt')  # DAU data in column D
-        update_sheet_with_query(client, worksheet, arena_finish_query, yesterday, 'G', 'date')  
-        update_sheet_with_query(client, worksheet, arena_finish_rewards_query, yesterday, 'I', 'date')  
-        update_sheet_with_query(client, worksheet, arena_ticket_consumption_query, yesterday, 'L', 'date') 
-        update_sheet_with_query(client, worksheet, character_gradeup_query, yesterday, 'M', 'date')  
+        # Find the row for yesterday once; every metric lands in the same row
+        date_row = load_date_row_index(worksheet).get(yesterday)
+        if date_row is None:
+            logging.warning(f"Date {yesterday} not found in the sheet.")
+            return f"Date {yesterday} not found in the sheet.", 200
+
+        # Compute every daily metric in one query and collect the cell writes into a single plan
+        write_plan = []
+        plan_metrics_write(client, 'daily_metrics_query', default_date_window(), {yesterday: date_row}, DAILY_METRIC_COLUMNS, write_plan)
+
+        # Flush every planned cell in one values write plus one format write
+        flush_write_plan(worksheet, write_plan)
 
         logging.info("Daily data updated in Google Sheets for yesterday!")
         return "Daily data updated in Google Sheets for yesterday!", 200
@@ -41,215 +58,107 @@ def update_data_in_sheets(request):
         logging.error(f"Error occurred: {e}")
         return f"An error occurred: {e}", 500
 
-def update_sheet_with_query(client, worksheet, query, date, column, date_column_name):
+_cold_start_pending = True
+
+def log_cold_start():
+    """Log how long the module imports took, once per instance."""
+    global _cold_start_pending
+    if _cold_start_pending:
+        logging.info(f"Cold start: module loaded in {MODULE_LOAD_SECONDS:.3f}s")
+        _cold_start_pending = False
+
+def fetch_query_rows(query_job):
+    """Wait for a submitted query job and return its rows as plain dicts, without going through pandas."""
+    return [dict(row.items()) for row in query_job.result()]
+
+def get_backfill_window(request):
+    """Read an optional start_date/end_date pair (YYYY-MM-DD) from the query string or JSON body."""
+    if request is None:
+        return None
+    params = dict(request.args or {})
+    params.update(request.get_json(silent=True) or {})
+    if not params.get('start_date') and not params.get('end_date'):
+        return None
+    if not params.get('start_date') or not params.get('end_date'):
+        raise ValueError("A backfill needs both start_date and end_date")
+
+    start_date = datetime.strptime(params['start_date'], '%Y-%m-%d').date()
+    end_date = datetime.strptime(params['end_date'], '%Y-%m-%d').date()
+    if end_date < start_date:
+        raise ValueError(f"Backfill end_date {end_date} is before start_date {start_date}")
+    return start_date, end_date
+
+def backfill_data_in_sheets(client, worksheet, start_date, end_date):
+    """Run the metrics query once over the whole range and write every date row in one batched pass."""
+    date_row_index = load_date_row_index(worksheet)
+    date_rows = {}
+    missing_dates = []
+    for day in range((end_date - start_date).days + 1):
+        date = (start_date + timedelta(days=day)).strftime('%Y-%m-%d')
+        if date in date_row_index:
+            date_rows[date] = date_row_index[date]
+        else:
+            missing_dates.append(date)
+    if missing_dates:
+        logging.warning(f"Backfill dates not found in the sheet: {', '.join(missing_dates)}")
+
+    write_plan = []
+    plan_metrics_write(client, 'daily_metrics_query', (start_date, end_date), date_rows, DAILY_METRIC_COLUMNS, write_plan)
+    flush_write_plan(worksheet, write_plan)
+
+    message = f"Backfilled {len(date_rows)} dates from {start_date} to {end_date}"
+    logging.info(message)
+    return message, 200
+
+def plan_metrics_write(client, query_id, date_window, date_rows, metric_columns, write_plan):
+    """Run a wide per-date metrics query once and add each metric's value for every date in date_rows to the write plan."""
     # Fetching data from BigQuery
-    results = client.query(query).result().to_dataframe()
-
-    # Check if the date exists in the results
-    if date not in results[date_column_name].values:
-        # Date not found, insert 0
-        try:
-            # Find the row in the sheet where the date matches
-            date_cell = worksheet.find(date)
-            # Update the count in the corresponding row and column with 0
-            cell = f'{column}{date_cell.row}'
-            worksheet.update_acell(cell, 0)
-            # Set the cell format to center align
-            worksheet.format(cell, {"horizontalAlignment": "CENTER"})
-        except gspread.exceptions.CellNotFound:
-            logging.warning(f"Date {date} not found in the sheet.")
-            return
-
-    # Update data for specified date in Google Sheets
-    for index, row in results.iterrows():
-        if row[date_column_name] == date:
-            try:
-                # Find the row in the sheet where the date matches
-                date_cell = worksheet.find(str(row[date_column_name]))
-                # Update the count in the corresponding row and column
-                cell = f'{column}{date_cell.row}'
-                worksheet.update_acell(cell, row['count'])
-                # Set the cell format to center align
-                worksheet.format(cell, {"horizontalAlignment": "CENTER"})
-            except gspread.exceptions.CellNotFound:
-                logging.warning(f"Date {row[date_column_name]} not found in the sheet.")
-                break
+    sql, job_config = render_query(query_id, *date_window)
+    results_by_date = {result['date']: result for result in fetch_query_rows(run_query(client, query_id, sql, job_config))}
+
+    for date, row in date_rows.items():
+        date_results = results_by_date.get(date)
+        for metric, column in metric_columns.items():
+            # Date not found in the results or a NULL metric, insert 0
+            value = 0 if date_results is None else int(date_results[metric] or 0)
+            write_plan.append({
+                'row': row,
+                'column': column,
+                'value': value,
+                'format': {"horizontalAlignment": "CENTER"}
+            })
+
+def flush_write_plan(worksheet, write_plan):
+    """Write all planned cells with one values.batchUpdate and one spreadsheets.batchUpdate."""
+    if not write_plan:
+        return
+
+    # Neighbouring cells are merged into rectangular ranges, so a backfill sends one range per column block
+    value_updates = build_value_blocks({
+        (item['row'], a1_to_rowcol(f"{item['column']}1")[1]): item['value']
+        for item in write_plan
+    })
+    cell_formats = [
+        (item['row'], a1_to_rowcol(f"{item['column']}1")[1], item['format'])
+        for item in write_plan if item.get('format')
+    ]
+    flush_sheet_writes(worksheet, value_updates, cell_formats)
+
+    logging.info(f"Wrote {len(write_plan)} planned cells as {len(value_updates)} ranges in one batch")
 
 # Define queries here
 
-# NRU data
-nru_query = """
-SELECT
-  FORMAT_DATE("%Y-%m-%d", CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE)) AS date,
-  COUNT(*) as count
-FROM
-  `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-WHERE
-  reason = '/user/create'
-  AND collectionName IN UNNEST(["create_user_detail"])
-  AND (
-    CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-    OR
-    CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-  )
-GROUP BY
-  date
-ORDER BY
-  date;
-"""
-
-# DAU data
-dau_query = """
-WITH
-  Step1 AS (
-    SELECT
-      PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS parsed_time,
-      nid
-    FROM
-      `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-    WHERE
-      reason = '/login'
-      AND collectionName IN UNNEST(["login"])
-      AND (
-        CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-        OR
-        CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-      )
-  ),
-  Step2 AS (
-    SELECT
-      FORMAT_DATE('%Y-%m-%d', parsed_time) AS dt,
-      nid,
-      COUNT(*) as count
-    FROM
-      Step1
-    GROUP BY
-      dt, nid
-  )
-SELECT
-  dt,
-  COUNT(nid) as count
-FROM
-  Step2
-GROUP BY
-  dt
-ORDER BY
-  dt;
-"""
-
-
-arena_finish_query = """
-SELECT
-  FORMAT_DATE("%Y-%m-%d", PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) AS date,
-  COUNT(*) as count
-FROM
-  `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-WHERE
-  reason = '/arena/finish'
-  AND collectionName IN UNNEST(["finish_arena"])
-  AND (
-    CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-    OR
-    CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-  )
-GROUP BY
-  date
-ORDER BY
-  date;
-"""
-
-
-arena_finish_rewards_query = """
-WITH
-  ParsedData AS (
-    SELECT
-      FORMAT_DATE("%Y-%m-%d", PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) AS date,
-      JSON_EXTRACT_SCALAR(contents, '$.reward.dataId') AS dataId,
-      CAST(JSON_EXTRACT_SCALAR(contents, '$.reward.quantity') AS INT64) AS quantity
-    FROM
-      `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-    WHERE
-      reason = '/arena/finish'
-      AND collectionName IN UNNEST(["payment_material"])
-      AND (
-        CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-        OR
-        CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-      )
-  )
-SELECT
-  date,
-  SUM(quantity) AS count
-FROM
-  ParsedData
-GROUP BY
-  date
-ORDER BY
-  date;
-"""
-
-
-arena_ticket_consumption_query = """
-WITH
-  ParsedData AS (
-    SELECT
-      PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS time,
-      CAST(JSON_EXTRACT_SCALAR(contents, '$.id') AS INT64) AS id,
-      CAST(JSON_EXTRACT_SCALAR(contents, '$.beforeValue') AS INT64) AS beforeValue,
-      CAST(JSON_EXTRACT_SCALAR(contents, '$.afterValue') AS INT64) AS afterValue
-    FROM
-      `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-    WHERE
-      reason = '/user/arenaTicket/charge'
-      AND collectionName IN UNNEST(["consume_material"])
-      AND (
-        CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) BETWEEN DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-        OR
-        CAST(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time) AS DATE) = LAST_DAY(DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH), MONTH)
-      )
-  ),
-  CalculatedData AS (
-    SELECT
-      FORMAT_DATE('%Y-%m-%d', time) AS date,
-      id,
-      beforeValue - afterValue AS quantity
-    FROM
-      ParsedData
-  )
-SELECT
-  date,
-  SUM(quantity) AS count
-FROM
-  CalculatedData
-WHERE
-  id = 403000
-GROUP BY
-  date
-ORDER BY
-  date;
-"""
-
-
-character_gradeup_query = """
-SELECT
-  FORMAT_DATE("%Y-%m-%d", PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) AS date,
-  COUNT(*) as count
-FROM
-  `somaz-bigquery.mongodb_dataset.production-mongodb-internal-table`
-WHERE
-  reason = '/character/gradeup'
-  AND collectionName IN UNNEST(["grade_up_character"])
-  AND (
-    DATE(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) BETWEEN 
-    DATE_TRUNC(CURRENT_DATE(), MONTH) AND CURRENT_DATE()
-    OR
-    DATE(PARSE_TIMESTAMP('%a %b %d %H:%M:%S UTC %Y', time)) = LAST_DAY(CURRENT_DATE() - INTERVAL 1 MONTH, MONTH)
-  )
-GROUP BY
-  date
-ORDER BY
-  date;
-"""
+# Sheet column of each metric computed by the daily_metrics_query template
+DAILY_METRIC_COLUMNS = {
+    'nru': 'B',                       # NRU
+    'dau': 'D',                       # DAU
+    'arena_finish': 'G',
+    'arena_finish_rewards': 'I',
+    'arena_ticket_consumption': 'L',
+    'character_gradeup': 'M',
+}
+
+MODULE_LOAD_SECONDS = time.perf_counter() - _module_load_started
 
 if __name__ == "__main__":
     update_data_in_sheets(None) # Passing None since we're not using the request object
@@ -0,0 +1,65 @@
+"""
+Parameterized SQL for the bigquery-to-sheet-simple queries.
+
+Each query reads its window from the typed @start_date and @end_date parameters, so the
+SQL text stays the same from run to run and BigQuery can serve repeats from its result cache.
+"""
+from datetime import date, timedelta
+from google.cloud import bigquery
+
+def default_date_window(today=None):
+    """The window of the daily run: the last day of the previous month through today."""
+    today = today or date.today()
+    return today.replace(day=1) - timedelta(days=1), today
+
+def date_window_job_config(start_date, end_date):
+    """Build a job config that binds @start_date and @end_date as DATE parameters."""
+    return bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('start_date', 'DATE', start_date),
+        bigquery.ScalarQueryParameter('end_date', 'DATE', end_date),
+    ])
+
+def render_query(query_id, start_date, end_date):
+    """Return the SQL of a query and the job config that binds its date window."""
+    return QUERY_TEMPLATES[query_id], date_window_job_config(start_date, end_date)
+
+# Every daily metric in one scan: each metric only differs by its reason/collectionName filter,
+# so they are computed with conditional aggregation over the union of those filters
+DAILY_METRICS_QUERY = """
+SELECT
+  FORMAT_DATE("%Y-%m-%d", event_date) AS date,
+  COUNTIF(reason = '/user/create' AND collectionName = 'create_user_detail') AS nru,
+  COUNT(DISTINCT IF(reason = '/login' AND collectionName = 'login', nid, NULL)) AS dau,
+  COUNTIF(reason = '/arena/finish' AND collectionName = 'finish_arena') AS arena_finish,
+  IFNULL(SUM(IF(
+    reason = '/arena/finish' AND collectionName = 'payment_material',
+    CAST(JSON_EXTRACT_SCALAR(contents, '$.reward.quantity') AS INT64),
+    NULL
+  )), 0) AS arena_finish_rewards,
+  IFNULL(SUM(IF(
+    reason = '/user/arenaTicket/charge' AND collectionName = 'consume_material'
+      AND CAST(JSON_EXTRACT_SCALAR(contents, '$.id') AS INT64) = 403000,
+    CAST(JSON_EXTRACT_SCALAR(contents, '$.beforeValue') AS INT64) - CAST(JSON_EXTRACT_SCALAR(contents, '$.afterValue') AS INT64),
+    NULL
+  )), 0) AS arena_ticket_consumption,
+  COUNTIF(reason = '/character/gradeup' AND collectionName = 'grade_up_character') AS character_gradeup
+FROM
+  `somaz-bigquery.mongodb_dataset.production-mongodb-parsed-events`
+WHERE
+  (
+    (reason = '/user/create' AND collectionName = 'create_user_detail')
+    OR (reason = '/login' AND collectionName = 'login')
+    OR (reason = '/arena/finish' AND collectionName IN ('finish_arena', 'payment_material'))
+    OR (reason = '/user/arenaTicket/charge' AND collectionName = 'consume_material')
+    OR (reason = '/character/gradeup' AND collectionName = 'grade_up_character')
+  )
+  AND event_date BETWEEN @start_date AND @end_date
+GROUP BY
+  date
+ORDER BY
+  date;
+"""
+
+QUERY_TEMPLATES = {
+    'daily_metrics_query': DAILY_METRICS_QUERY,
+}
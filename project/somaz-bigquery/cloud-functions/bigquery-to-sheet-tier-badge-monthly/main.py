@@ -5,6 +5,8 @@ from google.oauth2.service_account import Credentials
 import logging
 from datetime import datetime, timedelta
 import pandas as pd
+from sheet_helpers import open_worksheet
+from query_budget import run_query
 
 # Configure logging to display the date, time, and log level
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,8 +23,7 @@ def update_kpi_table_pack(request):
             ]
         )
         gc = gspread.authorize(creds)
-        sh = gc.open_by_key(os.getenv('SHEET_ID'))
-        worksheet = sh.worksheet('Somaz_Table(Pack)')
+        worksheet = open_worksheet(gc, os.getenv('SHEET_ID'), 'Somaz_Table(Pack)')
         
         # Fetch badge and tier counts from BigQuery
         badge_counts = fetch_badge_counts(client)
@@ -54,7 +55,7 @@ def fetch_badge_counts(client):
     GROUP BY badge_name
     ORDER BY badge_name DESC;
     """
-    job = client.query(badge_query)
+    job = run_query(client, 'badge_query', badge_query)
     result = job.result().to_dataframe()
     return result.set_index('badge_name')['user_count'].to_dict()
 
@@ -78,7 +79,7 @@ def fetch_tier_counts(client):
     GROUP BY tier_name
     ORDER BY tier_name DESC;
     """
-    job = client.query(tier_query)
+    job = run_query(client, 'tier_query', tier_query)
     result = job.result().to_dataframe()
     return result.set_index('tier_name')['user_count'].to_dict()
 
@@ -97,7 +98,6 @@ def find_row_by_date(worksheet, date):
             return idx + 1  # Found the row
     return None  # Date not found
 
-
 def update_sheet_with_counts(worksheet, badge_counts, tier_counts):
     # Set the current date as the first date of the month
     first_day_of_month = datetime.now().replace(day=1).strftime("%Y-%m-%d")
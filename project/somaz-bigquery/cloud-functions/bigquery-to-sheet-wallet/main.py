@@ -1,10 +1,13 @@
 import os
 import gspread
+from gspread.utils import a1_to_rowcol
 from google.cloud import bigquery
 from google.oauth2.service_account import Credentials
 import logging
 from datetime import datetime, timedelta
 import pandas as pd
+from sheet_helpers import open_worksheet, load_date_row_index, flush_sheet_writes
+from query_budget import run_query
 
 # Configure logging at the start of the script
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,8 +21,7 @@ def update_wallet_datas_in_sheets(request):
             'https://www.googleapis.com/auth/drive'
         ])
         gc = gspread.authorize(creds)
-        sh = gc.open_by_key(os.getenv('SHEET_ID'))
-        worksheet = sh.worksheet('Somaz_Community')
+        worksheet = open_worksheet(gc, os.getenv('SHEET_ID'), 'Somaz_Community')
         
         # Determine the date to query for
         today = datetime.now()
@@ -34,29 +36,37 @@ def update_wallet_datas_in_sheets(request):
         query_results = complex_query_1(client)
         query_results['date'] = pd.to_datetime(query_results['date']).dt.strftime('%Y-%m-%d')
 
+        # Read the date column once and reuse it for every item lookup
+        date_row_index = load_date_row_index(worksheet)
+
         # Update sheets with query results for the determined date
-        execute_and_update_for_query(client, worksheet, date_to_query, query_results, get_complex_query_1_mapping())
+        execute_and_update_for_query(client, worksheet, date_row_index, date_to_query, query_results, get_complex_query_1_mapping())
 
         return "Data updated successfully", 200
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         return f"An error occurred: {e}", 500
 
-def execute_and_update_for_query(client, worksheet, date, query, column_mapping):
+def execute_and_update_for_query(client, worksheet, date_row_index, date, query, column_mapping):
     results = query
+    value_updates = []
+    cell_formats = []
     for item_name, column in column_mapping.items():
-        update_sheet_for_item(worksheet, results, item_name, column, date)
+        update_sheet_for_item(worksheet, date_row_index, results, item_name, column, date, value_updates, cell_formats)
+
+    # Write every item together, with their formats merged into ranges
+    flush_sheet_writes(worksheet, value_updates, cell_formats)
 
 def get_last_day_of_previous_month():
     first_day_of_current_month = datetime.now().replace(day=1)
     last_day_of_previous_month = first_day_of_current_month - timedelta(days=1)
     return last_day_of_previous_month.strftime("%Y-%m-%d")
 
-def update_sheet_for_item(worksheet, results, item_name, column, date):
+def update_sheet_for_item(worksheet, date_row_index, results, item_name, column, date, value_updates, cell_formats):
     try:
-        date_cell = find_date_cell(worksheet, date)
-        if date_cell:
-            cell = f'{column}{date_cell.row}'
+        date_row = date_row_index.get(date)
+        if date_row:
+            cell = f'{column}{date_row}'
             # Check for results for that date, set to 0 if not
             filtered_results = results[results['date'] == date]
             date_data = 0 if filtered_results.empty else int(filtered_results[item_name].fillna(0).iloc[0])
@@ -64,17 +74,11 @@ def update_sheet_for_item(worksheet, results, item_name, column, date):
             # Log the update
             logging.info(f"Updating {cell} with {date_data} for {item_name}")
             
-            worksheet.update_acell(cell, date_data)
-            worksheet.format(cell, {"horizontalAlignment": "CENTER"})
+            value_updates.append({'range': cell, 'values': [[date_data]]})
+            cell_formats.append((date_row, a1_to_rowcol(cell)[1], {"horizontalAlignment": "CENTER"}))
     except Exception as e:
         logging.error(f"Error updating sheet for {item_name} on {date}: {e}")
 
-def find_date_cell(worksheet, date):
-    try:
-        return worksheet.find(date)
-    except gspread.exceptions.CellNotFound:
-        return None
-
 def complex_query_1(client):
     complex_query_1 = """
     SELECT
@@ -102,7 +106,7 @@ def complex_query_1(client):
     ORDER BY
         date;
     """
-    return client.query(complex_query_1).result().to_dataframe()
+    return run_query(client, 'complex_query_1', complex_query_1).result().to_dataframe()
 
 def get_complex_query_1_mapping():
     return {
@@ -1,13 +1,12 @@
 import os
 import gspread
-import re
 import time
 from datetime import datetime, timedelta
 from google.oauth2 import service_account
-from gspread.exceptions import CellNotFound
-from gspread.utils import a1_to_rowcol
-from gspread import Cell
-from googleapiclient.errors import HttpError as APIError
+from gspread.exceptions import APIError, CellNotFound
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from sheet_helpers import open_worksheet
+from formula_shift import shift_formula_references, has_cell_reference, build_copy_paste_request, formula_paste_ranges
 
 # Setup the Sheets and GA4 Data API
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/analytics']
@@ -19,19 +18,17 @@ creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FI
 # Initialize the Sheets API client
 gc = gspread.authorize(creds)
 
+# 'rewrite' shifts formulas locally, 'server' lets copyPaste requests shift them on the server
+PROPAGATION_MODE = os.getenv('PROPAGATION_MODE', 'rewrite')
+
+# Print the propagation plan and the estimated API calls without touching the sheet
+DRY_RUN = os.getenv('DRY_RUN', 'false').lower() == 'true'
+
 def get_all_dates(sheet):
     """Fetch all dates from the first column of the sheet."""
     time.sleep(0.5)  # Delay before reading
     return exponential_backoff_retry(lambda: sheet.col_values(1))
 
-def process_columns(sheet, specific_columns, date_row_mappings, updated_cells):
-    """Process given columns to update formulas."""
-    for col in specific_columns:
-        prev_date_row = date_row_mappings.get('prev_date_row')
-        date_row = date_row_mappings.get('date_row')
-        if prev_date_row and date_row:
-            copy_formulas_for_date(sheet, col, date_row, prev_date_row, updated_cells)
-
 def is_first_day_of_month(date):
     """Check if the given date is the first day of its month."""
     return date.day == 1
@@ -68,56 +65,105 @@ def exponential_backoff_retry(func, max_attempts=5, initial_wait=1.0, backoff_fa
                 raise  # Reraise for non-quota errors
     raise Exception("Maximum retry attempts exceeded")
 
-def wait_until_next_minute():
-    """Wait until the start of the next minute."""
-    now = datetime.now()
-    wait_time = 61 - now.second
-    print(f"Waiting for {wait_time} seconds until the start of the next minute...")
-    time.sleep(wait_time)
-
-def update_cells_in_chunks(sheet, cells, chunk_size=10):
-    for i in range(0, len(cells), chunk_size):
-        chunk = cells[i:i + chunk_size]
-        exponential_backoff_retry(lambda: sheet.update_cells(chunk, value_input_option='USER_ENTERED'))
-        print(f"Updated chunk of {chunk_size} cells, waiting before next batch...")
-        time.sleep(2)  # Increased delay to 2 seconds between batches
-
-
-def copy_formulas_for_date(sheet, column_letter, date_row, prev_date_row, updated_cells):
-    """Prepare formulas from previous date row to be updated in the given date row for a specific column."""
-    time.sleep(0.5)  # Delay before reading
-    try:
-        original_formula = sheet.acell(f'{column_letter}{prev_date_row}', value_render_option='FORMULA').value
-        if not isinstance(original_formula, str):
-            return
-        
-        print(f"Updating formula in column {column_letter}, row {date_row} based on row {prev_date_row}")  # Debug print
-
-        cell_references = re.findall(r'([A-Z]+)(\d+)', original_formula)
-        if cell_references:
-            updated_formula = original_formula
-            for col_ref, row_ref in cell_references:
-                new_row_number = int(row_ref) + (date_row - prev_date_row)
-                updated_formula = re.sub(rf'{col_ref}{row_ref}', f'{col_ref}{new_row_number}', updated_formula)
-            column_index = a1_to_rowcol(column_letter + '1')[1]
-            updated_cells.append(Cell(row=date_row, col=column_index, value=updated_formula))
-    except Exception as e:
-        print(f"Error processing cell {column_letter}{prev_date_row}: {e}")
-
-def process_columns_in_order(sheet, columns, date_row_mappings, updated_cells):
-    """Process columns in the specified order to update formulas."""
+def plan_copy(plan, columns, source_start_row, source_end_row, target_start_row):
+    """Add a copy of rows source_start_row..source_end_row to the plan; a target cell planned twice is kept once."""
     for col in columns:
-        print(f"Processing column {col}")
-        prev_date_row = date_row_mappings.get('prev_date_row')
-        date_row = date_row_mappings.get('date_row')
-        if prev_date_row and date_row:
-            copy_formulas_for_date(sheet, col, date_row, prev_date_row, updated_cells)
+        col_num = a1_to_rowcol(col + '1')[1]
+        for source_row in range(source_start_row, source_end_row + 1):
+            plan['requested_cells'] += 1
+            plan['cells'][(target_start_row + source_row - source_start_row, col_num)] = source_row
+
+def group_number_runs(numbers):
+    """Group numbers into (start, end) runs of consecutive values."""
+    runs = []
+    for number in sorted(set(numbers)):
+        if runs and runs[-1][1] == number - 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return [tuple(run) for run in runs]
+
+def build_plan_blocks(plan):
+    """Order the planned cells into rectangles of adjacent rows and columns that share one row offset."""
+    rows_by_column = {}
+    for (target_row, col_num), source_row in plan['cells'].items():
+        rows_by_column.setdefault((target_row - source_row, col_num), []).append(target_row)
+
+    columns_by_rows = {}
+    for (row_offset, col_num), rows in rows_by_column.items():
+        for first_row, last_row in group_number_runs(rows):
+            columns_by_rows.setdefault((row_offset, first_row, last_row), []).append(col_num)
+
+    blocks = []
+    for (row_offset, first_row, last_row), col_nums in sorted(columns_by_rows.items(), key=lambda item: (item[0][1], min(item[1]))):
+        for start_col, end_col in group_number_runs(col_nums):
+            blocks.append({
+                'source_start_row': first_row - row_offset,
+                'target_start_row': first_row,
+                'row_count': last_row - first_row + 1,
+                'start_col': start_col,
+                'end_col': end_col,
+            })
+    return blocks
+
+def block_range(start_row, row_count, start_col, end_col):
+    return f"{rowcol_to_a1(start_row, start_col)}:{rowcol_to_a1(start_row + row_count - 1, end_col)}"
+
+def print_plan(plan, blocks):
+    """Print the planned ranges and the API calls each propagation mode would make."""
+    for block in blocks:
+        source_range = block_range(block['source_start_row'], block['row_count'], block['start_col'], block['end_col'])
+        target_range = block_range(block['target_start_row'], block['row_count'], block['start_col'], block['end_col'])
+        cell_count = block['row_count'] * (block['end_col'] - block['start_col'] + 1)
+        print(f"  {source_range} -> {target_range} ({cell_count} cells)")
+    print(f"Planned {len(plan['cells'])} target cells in {len(blocks)} ranges "
+          f"({plan['requested_cells'] - len(plan['cells'])} duplicate cells removed)")
+    print("Estimated API calls: 2 in either mode (1 FORMULA batchGet + 1 batchUpdate), plus the date column read")
+
+def execute_plan_rewrite(sheet, blocks):
+    """Read every source range in one FORMULA batchGet, shift the formulas and write them in one batchUpdate."""
+    source_ranges = [block_range(block['source_start_row'], block['row_count'], block['start_col'], block['end_col']) for block in blocks]
+    source_blocks = exponential_backoff_retry(lambda: sheet.batch_get(source_ranges, value_render_option='FORMULA'))
+
+    data = []
+    for block, source_block in zip(blocks, source_blocks):
+        row_offset = block['target_start_row'] - block['source_start_row']
+        col_count = block['end_col'] - block['start_col'] + 1
+        values = []
+        for row_index in range(block['row_count']):
+            source_row = source_block[row_index] if row_index < len(source_block) else []
+            source_row = list(source_row) + [None] * (col_count - len(source_row))
+            # Cells without a formula are sent as None so the Sheets API leaves them untouched
+            values.append([
+                shift_formula_references(value, row_offset) if isinstance(value, str) and has_cell_reference(value) else None
+                for value in source_row
+            ])
+        target_range = block_range(block['target_start_row'], block['row_count'], block['start_col'], block['end_col'])
+        data.append({'range': target_range, 'values': values})
+
+    exponential_backoff_retry(lambda: sheet.batch_update(data, value_input_option='USER_ENTERED'))
+    print(f"Propagated {len(blocks)} ranges with one batchGet and one batchUpdate")
+
+def execute_plan_server(sheet, blocks):
+    """Read every source range in one FORMULA batchGet and copyPaste only its formula cells in one batchUpdate."""
+    source_ranges = [block_range(block['source_start_row'], block['row_count'], block['start_col'], block['end_col']) for block in blocks]
+    source_blocks = exponential_backoff_retry(lambda: sheet.batch_get(source_ranges, value_render_option='FORMULA'))
+
+    copy_requests = []
+    for block, source_block in zip(blocks, source_blocks):
+        col_numbers = range(block['start_col'], block['end_col'] + 1)
+        for row_offset, row_count, start_col, end_col in formula_paste_ranges(source_block, block['start_col'], col_numbers, block['row_count']):
+            copy_requests.append(build_copy_paste_request(sheet.id, block['source_start_row'] + row_offset,
+                                                          block['target_start_row'] + row_offset, start_col, end_col, row_count=row_count))
+    if copy_requests:
+        exponential_backoff_retry(lambda: sheet.spreadsheet.batch_update({'requests': copy_requests}))
+    print(f"Sent {len(copy_requests)} copyPaste requests in one batchUpdate")
 
 def propagate_formulas(request):
     sheet_id = os.getenv('SHEET_ID')  # Get the sheet ID from environment variables
     table_sheet_name = 'KPI_Table(Pack)'
 
-    table_sheet = gc.open_by_key(sheet_id).worksheet(table_sheet_name)
+    table_sheet = open_worksheet(gc, sheet_id, table_sheet_name)
 
     today = datetime.utcnow().date()
     first_day_of_previous_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
@@ -143,48 +189,28 @@ def propagate_formulas(request):
     first_day_of_two_months_ago_row = get_row_for_date(all_dates, first_day_of_two_months_ago_str)
     last_day_of_two_months_ago_row = get_row_for_date(all_dates, last_day_of_two_months_ago_str)
 
-    updated_cells = []
-
     # Check if rows are found
     if not first_day_of_previous_month_row or not first_day_of_two_months_ago_row:
         return "Required dates not found in the sheet"
 
-    print(f"Updating specific columns: {specific_columns}")
-    for col in specific_columns:
-        print(f"Processing column {col}")
-        copy_formulas_for_date(table_sheet, col, first_day_of_previous_month_row, first_day_of_two_months_ago_row, updated_cells)
-
-    # Get row numbers for required dates
-    date_row_mappings = {
-        'date_row': get_row_for_date(all_dates, first_day_of_previous_month_str),
-        'prev_date_row': get_row_for_date(all_dates, first_day_of_two_months_ago_str)
-    }
-
-    # Process specific_columns and other_columns in order
-    process_columns_in_order(table_sheet, specific_columns, date_row_mappings, updated_cells)
-    process_columns_in_order(table_sheet, other_columns, date_row_mappings, updated_cells)
-
-
-    # Temporarily skip processing other_columns to debug
-    skip_other_columns = False  # Set this to False to enable processing of other_columns
-
-    if not skip_other_columns:
-        for col in other_columns:
-            print(f"Processing column {col}")  # 디버깅을 위한 출력
-            for day in range(first_day_of_two_months_ago_row, last_day_of_two_months_ago_row + 1):
-                target_row = day + (first_day_of_previous_month_row - first_day_of_two_months_ago_row)
-                if day < last_day_of_two_months_ago_row:  # 이번달 1일은 제외
-                    print(f"Updating column {col} for day {day} at target row {target_row}")  # 디버깅을 위한 출력
-                    copy_formulas_for_date(table_sheet, col, target_row, day, updated_cells)
-
-    # Batch update to optimize API calls
-    if updated_cells:
-        try:
-            # Wrapping the update call in the retry logic
-            update_cells_in_chunks(table_sheet, updated_cells, chunk_size=10)  # You can adjust the chunk size
-            print("Batch update successful")
-        except Exception as e:
-            print(f"Batch update failed: {e}")
+    # The first row of the month takes every column; other_columns also take the rest of the month,
+    # leaving out the last source day (이번달 1일은 제외)
+    plan = {'requested_cells': 0, 'cells': {}}
+    plan_copy(plan, specific_columns + other_columns, first_day_of_two_months_ago_row,
+              first_day_of_two_months_ago_row, first_day_of_previous_month_row)
+    if last_day_of_two_months_ago_row:
+        plan_copy(plan, other_columns, first_day_of_two_months_ago_row,
+                  last_day_of_two_months_ago_row - 1, first_day_of_previous_month_row)
+    blocks = build_plan_blocks(plan)
+
+    print_plan(plan, blocks)
+    if DRY_RUN:
+        return f"Dry run: {len(plan['cells'])} cells planned in {len(blocks)} ranges for {first_day_of_previous_month_str}."
+
+    if PROPAGATION_MODE == 'server':
+        execute_plan_server(table_sheet, blocks)
+    else:
+        execute_plan_rewrite(table_sheet, blocks)
 
     return f"Formulas propagated to rows for {first_day_of_previous_month_str} in both sheets."
 
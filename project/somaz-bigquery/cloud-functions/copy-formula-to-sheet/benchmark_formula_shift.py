@@ -0,0 +1,64 @@
+"""
+Micro-benchmark for the formula row shifter.
+
+Reads every formula from KPI_Table (or from a file with one formula per line) and times the
+legacy findall/re.sub loop against the single-pass tokenizer in shared/formula_shift.py.
+
+Usage:
+    SHEET_ID=... PYTHONPATH=../shared python benchmark_formula_shift.py
+    PYTHONPATH=../shared python benchmark_formula_shift.py formulas.txt
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+
+from main import AsyncSheetsClient, creds
+from formula_shift import shift_formula_references
+
+ROW_OFFSET = 1
+REPEAT = 5
+
+def legacy_shift(original_formula, row_offset):
+    """The previous rewrite: one re.sub over the whole formula per reference found."""
+    updated_formula = original_formula
+    for col_ref, row_ref in re.findall(r'([A-Z]+)(\d+)', original_formula):
+        updated_formula = re.sub(rf'{col_ref}{row_ref}', f'{col_ref}{int(row_ref) + row_offset}', updated_formula)
+    return updated_formula
+
+async def fetch_sheet_formulas(sheet_id, sheet_name):
+    client = AsyncSheetsClient(creds)
+    try:
+        rows = (await client.values_batch_get(sheet_id, [f"'{sheet_name}'"], value_render_option='FORMULA'))[0]
+    finally:
+        await client.close()
+    return [value for row in rows for value in row if isinstance(value, str) and value.startswith('=')]
+
+def time_shifter(shifter, formulas):
+    best = None
+    for _ in range(REPEAT):
+        start_time = time.perf_counter()
+        for formula in formulas:
+            shifter(formula, ROW_OFFSET)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            formulas = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        formulas = asyncio.run(fetch_sheet_formulas(os.getenv('SHEET_ID'), 'KPI_Table'))
+
+    legacy_time = time_shifter(legacy_shift, formulas)
+    token_time = time_shifter(shift_formula_references, formulas)
+    differing = [f for f in formulas if legacy_shift(f, ROW_OFFSET) != shift_formula_references(f, ROW_OFFSET)]
+
+    print(f"Formulas: {len(formulas)} (best of {REPEAT} runs)")
+    print(f"Legacy regex loop: {legacy_time * 1000:.1f} ms")
+    print(f"Tokenizer:         {token_time * 1000:.1f} ms ({legacy_time / token_time:.1f}x)" if token_time else "Tokenizer: 0 ms")
+    print(f"Formulas where the results differ: {len(differing)}")
+    for formula in differing[:10]:
+        print(f"  {formula}\n    legacy:    {legacy_shift(formula, ROW_OFFSET)}\n    tokenizer: {shift_formula_references(formula, ROW_OFFSET)}")
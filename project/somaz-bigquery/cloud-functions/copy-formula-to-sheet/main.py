@@ -1,8 +1,11 @@
 import os
-import gspread
-import re
+import time
+import asyncio
+import httpx
 from datetime import datetime, timedelta
 from google.oauth2 import service_account
+from google.auth.transport.requests import Request
+from formula_shift import shift_formula_references, has_cell_reference, build_copy_paste_request, formula_paste_ranges
 
 # Setup the Sheets and GA4 Data API
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/analytics']
@@ -12,45 +15,398 @@ SERVICE_ACCOUNT_FILE = 'bigquery.json'
 creds = service_account.Credentials.from_service_account_file(
     SERVICE_ACCOUNT_FILE, scopes=SCOPES)
 
-# Initialize the Sheets API client
-gc = gspread.authorize(creds)
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets'
 
-def copy_formulas_for_date(sheet, column_letter, date_row, prev_date_row):
-    """Copy formulas from previous date row to the given date row for a specific column."""
+# Maximum number of Sheets API calls in flight at once
+MAX_CONCURRENCY = int(os.getenv('SHEETS_MAX_CONCURRENCY', '4'))
+
+# 'rewrite' shifts formulas locally, 'server' lets a copyPaste request shift them on the server
+PROPAGATION_MODE = os.getenv('PROPAGATION_MODE', 'rewrite')
+
+# Run the retention and monthly propagations in the same pass as the daily KPI sheets
+COMBINED_PROPAGATION = os.getenv('COMBINED_PROPAGATION', 'false').lower() == 'true'
+
+# sheetIds reused across warm invocations
+_sheet_id_cache = {}
+SHEET_ID_TTL_SECONDS = 600
+
+class AsyncSheetsClient:
+    """Small asyncio Sheets API client whose calls share one HTTP/2 connection."""
+
+    def __init__(self, credentials, max_concurrency=MAX_CONCURRENCY):
+        self.credentials = credentials
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.token_lock = asyncio.Lock()
+        self.session = httpx.AsyncClient(http2=True, timeout=60.0)
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def get_token(self):
+        """Return a valid access token, refreshing it off the event loop when it has expired."""
+        async with self.token_lock:
+            if not self.credentials.valid:
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, self.credentials.refresh, Request())
+        return self.credentials.token
+
+    async def request(self, method, url, max_attempts=5, initial_wait=2.0, **kwargs):
+        """Send one API call, backing off exponentially while the quota is exceeded."""
+        wait_time = initial_wait
+        for attempt in range(max_attempts):
+            token = await self.get_token()
+            async with self.semaphore:
+                response = await self.session.request(method, url, headers={'Authorization': f'Bearer {token}'}, **kwargs)
+            if response.status_code != 429 or attempt == max_attempts - 1:
+                break
+            print(f"Quota exceeded, retrying in {wait_time} seconds...")
+            await asyncio.sleep(wait_time)
+            wait_time *= 2
+        response.raise_for_status()
+        return response.json()
+
+    async def values_batch_get(self, spreadsheet_id, ranges, value_render_option='FORMATTED_VALUE'):
+        """Read several ranges in one call and return their values in the same order."""
+        params = [('ranges', range_name) for range_name in ranges] + [('valueRenderOption', value_render_option)]
+        data = await self.request('GET', f'{SHEETS_API_URL}/{spreadsheet_id}/values:batchGet', params=params)
+        return [value_range.get('values', []) for value_range in data.get('valueRanges', [])]
+
+    async def values_batch_update(self, spreadsheet_id, data, value_input_option='USER_ENTERED'):
+        """Write several ranges in one call."""
+        body = {'valueInputOption': value_input_option, 'data': data}
+        return await self.request('POST', f'{SHEETS_API_URL}/{spreadsheet_id}/values:batchUpdate', json=body)
+
+    async def batch_update(self, spreadsheet_id, requests):
+        """Send several spreadsheet requests in one spreadsheets.batchUpdate call."""
+        return await self.request('POST', f'{SHEETS_API_URL}/{spreadsheet_id}:batchUpdate', json={'requests': requests})
+
+    async def get_sheet_ids(self, spreadsheet_id):
+        """Return {title: sheetId} for the spreadsheet, cached for SHEET_ID_TTL_SECONDS."""
+        entry = _sheet_id_cache.get(spreadsheet_id)
+        if entry is None or time.time() - entry['fetched_at'] > SHEET_ID_TTL_SECONDS:
+            data = await self.request('GET', f'{SHEETS_API_URL}/{spreadsheet_id}', params={'fields': 'sheets.properties(sheetId,title)'})
+            entry = {
+                'fetched_at': time.time(),
+                'sheet_ids': {sheet['properties']['title']: sheet['properties']['sheetId'] for sheet in data.get('sheets', [])},
+            }
+            _sheet_id_cache[spreadsheet_id] = entry
+        return entry['sheet_ids']
+
+def column_letter_to_number(column_letter):
+    """Convert a column letter (e.g. 'AA') into its 1-based column number (e.g. 27)."""
+    number = 0
+    for char in column_letter:
+        number = number * 26 + ord(char) - 64
+    return number
+
+def column_number_to_letter(col_num):
+    """Convert a 1-based column number (e.g. 27) into its column letter (e.g. 'AA')."""
+    letter = ''
+    while col_num > 0:
+        col_num, remainder = divmod(col_num - 1, 26)
+        letter = chr(65 + remainder) + letter
+    return letter
+
+def index_date_column(date_column):
+    """Map each date string of column A to its 1-based row number."""
+    date_rows = {}
+    for index, row in enumerate(date_column, start=1):
+        if row:
+            date_rows.setdefault(row[0].strip(), index)
+    return date_rows
+
+async def copy_formulas_server_side(sheet_id, sheet_columns, date_str, prev_date_str):
+    """Propagate the formula cells of every worksheet with copyPaste requests sent in a single batchUpdate."""
+    client = AsyncSheetsClient(creds)
     try:
-        original_formula = sheet.acell(f'{column_letter}{prev_date_row}', value_render_option='FORMULA').value
-        print(f"Original formula in {column_letter}{prev_date_row}: {original_formula}")  # Debug print
+        sheet_ids, date_columns = await asyncio.gather(
+            client.get_sheet_ids(sheet_id),
+            client.values_batch_get(sheet_id, [f"'{sheet_name}'!A:A" for sheet_name in sheet_columns]),
+        )
+
+        sources = []
+        for (sheet_name, columns), date_column in zip(sheet_columns.items(), date_columns):
+            date_rows = index_date_column(date_column)
+            date_row = date_rows.get(date_str)
+            prev_date_row = date_rows.get(prev_date_str)
+            if not date_row or not prev_date_row:
+                print(f"Date not found in the sheet {sheet_name}")
+                continue
+            col_numbers = sorted(set(column_letter_to_number(col) for col in columns))
+            sources.append((sheet_name, col_numbers, prev_date_row, date_row))
+
+        # One FORMULA read of the source rows, so only cells holding a formula are pasted
+        source_blocks = await client.values_batch_get(
+            sheet_id, [sheet_a1_range(sheet_name, prev_date_row, 1, col_numbers[0], col_numbers[-1])
+                       for sheet_name, col_numbers, prev_date_row, _ in sources],
+            value_render_option='FORMULA') if sources else []
+
+        copy_requests = []
+        for (sheet_name, col_numbers, prev_date_row, date_row), source_block in zip(sources, source_blocks):
+            for _, _, start_col, end_col in formula_paste_ranges(source_block, col_numbers[0], col_numbers, 1):
+                copy_requests.append(build_copy_paste_request(sheet_ids[sheet_name], prev_date_row, date_row, start_col, end_col))
+
+        if copy_requests:
+            await client.batch_update(sheet_id, copy_requests)
+        print(f"Sent {len(copy_requests)} copyPaste requests in one batchUpdate")
+        return len(copy_requests)
+    finally:
+        await client.close()
+
+async def copy_formulas_for_date(client, sheet_id, sheet_name, columns, date_str, prev_date_str):
+    """Copy formulas of the given columns from the previous date row to the date row of one worksheet."""
+    # Find the rows for the respective dates
+    date_column = (await client.values_batch_get(sheet_id, [f"'{sheet_name}'!A:A"]))[0]
+    date_rows = index_date_column(date_column)
+    date_row = date_rows.get(date_str)
+    prev_date_row = date_rows.get(prev_date_str)
+    if not date_row or not prev_date_row:
+        print(f"Date not found in the sheet {sheet_name}")
+        return 0
+
+    # Read every source formula of the previous date row in one request
+    source_ranges = [f"'{sheet_name}'!{col}{prev_date_row}" for col in columns]
+    source_values = await client.values_batch_get(sheet_id, source_ranges, value_render_option='FORMULA')
+
+    updates = []
+    for col, values in zip(columns, source_values):
+        original_formula = values[0][0] if values and values[0] else None
+        print(f"Original formula in {sheet_name}!{col}{prev_date_row}: {original_formula}")  # Debug print
 
         if not isinstance(original_formula, str):
-            print(f"Formula not found or not a string in cell {column_letter}{prev_date_row}: {original_formula}")
-            return
-
-        # Regex to find all cell references in the formula
-        cell_references = re.findall(r'([A-Z]+)(\d+)', original_formula)
-        if cell_references:
-            updated_formula = original_formula
-            for col_ref, row_ref in cell_references:
-                new_row_number = int(row_ref) + 1  # Incrementing the row number
-                updated_formula = re.sub(rf'{col_ref}{row_ref}', f'{col_ref}{new_row_number}', updated_formula)
-
-            # Update the cell with the new formula
-            sheet.update_acell(f'{column_letter}{date_row}', updated_formula)
-        else:
+            print(f"Formula not found or not a string in cell {col}{prev_date_row}: {original_formula}")
+            continue
+
+        if not has_cell_reference(original_formula):
             print(f"No cell references found in formula: {original_formula}")
+            continue
+        updated_formula = shift_formula_references(original_formula, date_row - prev_date_row)
+        updates.append({'range': f"'{sheet_name}'!{col}{date_row}", 'values': [[updated_formula]]})
+
+    # Write every updated formula of this worksheet in one request
+    if updates:
+        await client.values_batch_update(sheet_id, updates)
+    return len(updates)
+
+async def propagate_all_sheets(sheet_id, sheet_columns, date_str, prev_date_str):
+    """Propagate formulas of independent worksheets concurrently over one shared client."""
+    client = AsyncSheetsClient(creds)
+    try:
+        return await asyncio.gather(*[
+            copy_formulas_for_date(client, sheet_id, sheet_name, columns, date_str, prev_date_str)
+            for sheet_name, columns in sheet_columns.items()
+        ])
+    finally:
+        await client.close()
+
+def days_before(days):
+    """Row rule: the date a number of days before today."""
+    return lambda today: today - timedelta(days=days)
 
-    except Exception as e:
-        print(f"Error processing cell {column_letter}{prev_date_row}: {e}")
+def first_day_of_months_before(months):
+    """Row rule: the first day of the month a number of months before the current one."""
+    def rule(today):
+        first_day = today.replace(day=1)
+        for _ in range(months):
+            first_day = (first_day - timedelta(days=1)).replace(day=1)
+        return first_day
+    return rule
 
+def column_span(start_col, end_col):
+    """List every column letter from start_col to end_col inclusive."""
+    return [column_number_to_letter(col_num) for col_num in range(column_letter_to_number(start_col), column_letter_to_number(end_col) + 1)]
+
+def build_propagation_jobs(sheet_columns):
+    """
+    Every formula propagation of the spreadsheet as (worksheet, columns, source row rule, target row rule) jobs.
+    A job copies the rows from source to source_end (default: source) so they start at target.
+    """
+    jobs = [
+        {'sheet': sheet_name, 'columns': columns, 'source': days_before(2), 'target': days_before(1)}
+        for sheet_name, columns in sheet_columns.items()
+    ]
+    # Formerly copy-formula-retention-to-sheet
+    jobs.append({'sheet': 'Somaz_Retention', 'columns': column_span('C', 'FO'),
+                 'source': days_before(2), 'target': days_before(1), 'align_center': True})
+    # Formerly copy-formula-monthly-to-sheet, run on the first day of the month; other_columns take
+    # the whole month except its last day (이번달 1일은 제외)
+    is_first_day_of_month = lambda today: today.day == 1
+    jobs.append({'sheet': 'KPI_Table(Pack)', 'columns': column_span('J', 'W'),
+                 'source': first_day_of_months_before(2), 'target': first_day_of_months_before(1),
+                 'when': is_first_day_of_month})
+    jobs.append({'sheet': 'KPI_Table(Pack)', 'columns': column_span('AG', 'AK') + column_span('AX', 'BB'),
+                 'source': first_day_of_months_before(2), 'target': first_day_of_months_before(1),
+                 'source_end': lambda today: first_day_of_months_before(1)(today) - timedelta(days=2),
+                 'when': is_first_day_of_month})
+    return jobs
+
+def sheet_grid_range(sheet_grid_id, start_row, row_count, start_col, end_col):
+    return {
+        'sheetId': sheet_grid_id,
+        'startRowIndex': start_row - 1, 'endRowIndex': start_row - 1 + row_count,
+        'startColumnIndex': start_col - 1, 'endColumnIndex': end_col,
+    }
+
+def sheet_a1_range(sheet_name, start_row, row_count, start_col, end_col):
+    return f"'{sheet_name}'!{column_number_to_letter(start_col)}{start_row}:{column_number_to_letter(end_col)}{start_row + row_count - 1}"
+
+def job_label(job):
+    """Name a job by its worksheet and column span for log messages, e.g. KPI_Table(Pack)!J..W."""
+    return f"{job['sheet']}!{job['columns'][0]}..{job['columns'][-1]}"
+
+async def read_date_rows(client, sheet_id, sheet_names):
+    """
+    Read column A of every worksheet in one batchGet and index it by date.
+    If the combined read fails, each worksheet is read on its own; the ones that still fail are returned with their error.
+    """
+    try:
+        date_columns = await client.values_batch_get(sheet_id, [f"'{sheet_name}'!A:A" for sheet_name in sheet_names])
+        return {sheet_name: index_date_column(date_column) for sheet_name, date_column in zip(sheet_names, date_columns)}, {}
+    except httpx.HTTPStatusError as e:
+        print(f"Date column read failed ({e}), reading each worksheet on its own")
+
+    date_rows_by_sheet = {}
+    read_errors = {}
+    for sheet_name in sheet_names:
+        try:
+            date_rows_by_sheet[sheet_name] = index_date_column((await client.values_batch_get(sheet_id, [f"'{sheet_name}'!A:A"]))[0])
+        except httpx.HTTPStatusError as e:
+            read_errors[sheet_name] = e
+    return date_rows_by_sheet, read_errors
+
+async def apply_job_blocks(client, sheet_id, blocks):
+    """Apply resolved job blocks with one source read and one cross-sheet write, by copyPaste in server mode or by rewriting formulas."""
+    sheet_ids = {}
+    if PROPAGATION_MODE == 'server' or any(block['job'].get('align_center') for block in blocks):
+        sheet_ids = await client.get_sheet_ids(sheet_id)
+
+    format_requests = [
+        {
+            'repeatCell': {
+                'range': sheet_grid_range(sheet_ids[block['job']['sheet']], block['target_start_row'], block['row_count'],
+                                          block['col_numbers'][0], block['col_numbers'][-1]),
+                'cell': {'userEnteredFormat': {'horizontalAlignment': 'CENTER'}},
+                'fields': 'userEnteredFormat.horizontalAlignment',
+            }
+        }
+        for block in blocks if block['job'].get('align_center')
+    ]
+
+    # One FORMULA read of every source rectangle, across all worksheets
+    source_ranges = [
+        sheet_a1_range(block['job']['sheet'], block['source_start_row'], block['row_count'], block['col_numbers'][0], block['col_numbers'][-1])
+        for block in blocks
+    ]
+    source_blocks = await client.values_batch_get(sheet_id, source_ranges, value_render_option='FORMULA')
+
+    if PROPAGATION_MODE == 'server':
+        # Paste only the cells that hold a formula, so constants and blanks of the source rows stay where they are
+        copy_requests = []
+        for block, source_block in zip(blocks, source_blocks):
+            paste_ranges = formula_paste_ranges(source_block, block['col_numbers'][0], block['col_numbers'], block['row_count'])
+            for row_offset, row_count, start_col, end_col in paste_ranges:
+                copy_requests.append(build_copy_paste_request(
+                    sheet_ids[block['job']['sheet']], block['source_start_row'] + row_offset, block['target_start_row'] + row_offset,
+                    start_col, end_col, row_count=row_count))
+        await client.batch_update(sheet_id, copy_requests + format_requests)
+        print(f"Applied {len(blocks)} jobs with one batchGet and {len(copy_requests)} copyPaste requests in one batchUpdate")
+        return
+
+    data = []
+    for block, source_block in zip(blocks, source_blocks):
+        first_col, last_col = block['col_numbers'][0], block['col_numbers'][-1]
+        listed_columns = set(block['col_numbers'])
+        row_offset = block['target_start_row'] - block['source_start_row']
+        values = []
+        for row_index in range(block['row_count']):
+            source_row = source_block[row_index] if row_index < len(source_block) else []
+            target_row = []
+            for col_num in range(first_col, last_col + 1):
+                value = source_row[col_num - first_col] if col_num - first_col < len(source_row) else None
+                # Unlisted columns and cells without references are sent as None and left untouched
+                if col_num in listed_columns and isinstance(value, str) and has_cell_reference(value):
+                    target_row.append(shift_formula_references(value, row_offset))
+                else:
+                    target_row.append(None)
+            values.append(target_row)
+        data.append({
+            'range': sheet_a1_range(block['job']['sheet'], block['target_start_row'], block['row_count'], first_col, last_col),
+            'values': values,
+        })
+
+    # One write for every worksheet
+    await client.values_batch_update(sheet_id, data)
+    if format_requests:
+        await client.batch_update(sheet_id, format_requests)
+    print(f"Applied {len(blocks)} jobs with one batchGet and one batchUpdate")
+
+async def run_propagation_jobs(sheet_id, jobs, today):
+    """
+    Resolve the rows of every job from one date-column read and apply all jobs in one cross-sheet write.
+    If the combined write fails, each job is applied on its own so one broken job does not block the others.
+    Returns the number of applied jobs and a list of (job label, error) failures.
+    """
+    jobs = [job for job in jobs if job.get('when', lambda today: True)(today)]
+    sheet_names = list(dict.fromkeys(job['sheet'] for job in jobs))
+
+    client = AsyncSheetsClient(creds)
+    try:
+        date_rows_by_sheet, read_errors = await read_date_rows(client, sheet_id, sheet_names)
+
+        blocks = []
+        failures = []
+        for job in jobs:
+            if job['sheet'] in read_errors:
+                failures.append((job_label(job), read_errors[job['sheet']]))
+                continue
+            date_rows = date_rows_by_sheet[job['sheet']]
+            source_start_row = date_rows.get(job['source'](today).strftime('%Y-%m-%d'))
+            source_end_row = date_rows.get(job.get('source_end', job['source'])(today).strftime('%Y-%m-%d'))
+            target_start_row = date_rows.get(job['target'](today).strftime('%Y-%m-%d'))
+            if not source_start_row or not source_end_row or not target_start_row or source_end_row < source_start_row:
+                print(f"Date not found in the sheet {job['sheet']}, skipping columns {job['columns'][0]}..{job['columns'][-1]}")
+                continue
+            col_numbers = sorted(set(column_letter_to_number(col) for col in job['columns']))
+            blocks.append({
+                'job': job,
+                'source_start_row': source_start_row,
+                'target_start_row': target_start_row,
+                'row_count': source_end_row - source_start_row + 1,
+                'col_numbers': col_numbers,
+            })
+
+        if not blocks:
+            return 0, failures
+
+        try:
+            await apply_job_blocks(client, sheet_id, blocks)
+            return len(blocks), failures
+        except (httpx.HTTPStatusError, KeyError) as e:
+            if len(blocks) == 1:
+                return 0, failures + [(job_label(blocks[0]['job']), e)]
+            print(f"Combined write failed ({e!r}), applying each job on its own")
+
+        applied = 0
+        for block in blocks:
+            try:
+                await apply_job_blocks(client, sheet_id, [block])
+                applied += 1
+            except (httpx.HTTPStatusError, KeyError) as e:
+                failures.append((job_label(block['job']), e))
+        return applied, failures
+    finally:
+        await client.close()
 
 def propagate_formulas(request):
     # IDs and Sheet names
     sheet_id = os.getenv('SHEET_ID')  # Get the sheet ID from environment variables
-    community_sheet_name = 'KPI_Community'
-    table_sheet_name = 'KPI_Table'
 
-    # Open the worksheets
-    community_sheet = gc.open_by_key(sheet_id).worksheet(community_sheet_name)
-    table_sheet = gc.open_by_key(sheet_id).worksheet(table_sheet_name)
+    # Columns to update in the KPI_Community and KPI_Table sheets
+    sheet_columns = {
+        'KPI_Community': ['I', 'M'],
+        'KPI_Table': ['C', 'E', 'F', 'H', 'K', 'DM', 'DN'] + \
+                     ['BG', 'BH', 'BI', 'BJ', 'BK', 'CK', 'CL', 'CM', 'CN', 'CO', 'CZ', 'DA', 'DB', 'DC', 'DD', 'DE', 'DF', 'DG']  # Added new columns here
+    }
 
     # Calculate the dates
     today = datetime.utcnow().date()
@@ -61,31 +417,21 @@ def propagate_formulas(request):
     one_day_before_str = one_day_before.strftime('%Y-%m-%d')
     two_days_before_str = two_days_before.strftime('%Y-%m-%d')
 
-    # Find the rows for the respective dates
-    try:
-        # For KPI_Community sheet
-        one_day_before_row_community = community_sheet.find(one_day_before_str, in_column=1).row
-        two_days_before_row_community = community_sheet.find(two_days_before_str, in_column=1).row
-        
-        # For KPI_Table sheet
-        one_day_before_row_table = table_sheet.find(one_day_before_str, in_column=1).row
-        two_days_before_row_table = table_sheet.find(two_days_before_str, in_column=1).row
-
-    except gspread.exceptions.CellNotFound:
-        # Handle the case where the dates are not found
-        print(f"Date not found in the sheet")
-        return
-
-    # Update the KPI_Community sheet
-    community_columns = ['I', 'M']
-    for col in community_columns:
-        copy_formulas_for_date(community_sheet, col, one_day_before_row_community, two_days_before_row_community)
-
-    # Update the KPI_Table sheet
-    table_columns = ['C', 'E', 'F', 'H', 'K', 'DM', 'DN'] + \
-                    ['BG', 'BH', 'BI', 'BJ', 'BK', 'CK', 'CL', 'CM', 'CN', 'CO', 'CZ', 'DA', 'DB', 'DC', 'DD', 'DE', 'DF', 'DG']  # Added new columns here
-    for col in table_columns:
-        copy_formulas_for_date(table_sheet, col, one_day_before_row_table, two_days_before_row_table)
+    start_time = time.time()
+    if COMBINED_PROPAGATION and PROPAGATION_MODE in ('rewrite', 'server'):
+        job_count, failures = asyncio.run(run_propagation_jobs(sheet_id, build_propagation_jobs(sheet_columns), today))
+        print(f"Applied {job_count} propagation jobs in {time.time() - start_time:.1f}s")
+        for label, error in failures:
+            print(f"Propagation job {label} failed: {error!r}")
+        if failures:
+            return f"Formulas propagated for {job_count} jobs on {one_day_before_str}; failed: {', '.join(label for label, _ in failures)}.", 500
+        return f"Formulas propagated for {job_count} jobs on {one_day_before_str}."
+    elif PROPAGATION_MODE == 'server':
+        asyncio.run(copy_formulas_server_side(sheet_id, sheet_columns, one_day_before_str, two_days_before_str))
+        print(f"Propagated formulas server-side across {len(sheet_columns)} sheets in {time.time() - start_time:.1f}s")
+    else:
+        updated_counts = asyncio.run(propagate_all_sheets(sheet_id, sheet_columns, one_day_before_str, two_days_before_str))
+        print(f"Updated {sum(updated_counts)} formulas across {len(sheet_columns)} sheets in {time.time() - start_time:.1f}s")
 
     return f"Formulas propagated to rows for {one_day_before_str} in both sheets."
 
@@ -96,5 +442,3 @@ if __name__ == '__main__':
             return {}
 
     propagate_formulas(MockRequest())
-
-
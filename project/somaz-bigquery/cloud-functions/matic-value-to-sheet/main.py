@@ -1,8 +1,10 @@
 import os
 import gspread
+from gspread.utils import a1_to_rowcol
 from google.oauth2.service_account import Credentials
 import requests
 from datetime import datetime, timedelta
+from sheet_helpers import open_worksheet, load_date_row_index, append_date_row, flush_sheet_writes
 
 # Google Sheets scope and credentials
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
@@ -54,28 +56,25 @@ def get_polygon_data():
 
 def update_sheet(gc, sheet_id, today, opening_price):
     # Open the spreadsheet and the specific sheet
-    sh = gc.open_by_key(sheet_id)
-    worksheet = sh.worksheet('Somaz_Table')  # Make sure the sheet name is correct
+    worksheet = open_worksheet(gc, sheet_id, 'Somaz_Table')  # Make sure the sheet name is correct
 
-    # Try to find the cell with today's date
-    try:
-        cell = worksheet.find(today)
-        row_number = cell.row
-    except gspread.exceptions.CellNotFound:
-        # If today's date is not found, find the next empty row at the bottom of the sheet
-        all_values = worksheet.get_all_values()
-        row_number = len(all_values) + 1 if all_values else 1
+    # Look up today's date in the date column, appending it at the bottom if missing
+    date_row_index = load_date_row_index(worksheet)
+    row_number = date_row_index.get(today)
+    if row_number is None:
+        row_number = append_date_row(worksheet, date_row_index, today)
 
     # Update the cell in column CY with new data
     cy_column = 'CY'  # Adjust the column as needed
     cell_range = f'{cy_column}{row_number}'
-    worksheet.update(cell_range, [[opening_price]], value_input_option='USER_ENTERED')  # Ensure data is a list of lists
+    value_updates = [{'range': cell_range, 'values': [[opening_price]]}]  # Ensure data is a list of lists
 
     # Apply formatting for center alignment and two decimal places
-    worksheet.format(cell_range, {
+    cell_formats = [(row_number, a1_to_rowcol(cell_range)[1], {
         "horizontalAlignment": "CENTER",
         "numberFormat": {"type": "NUMBER", "pattern": "#,##0.00"}
-    })
+    })]
+    flush_sheet_writes(worksheet, value_updates, cell_formats)
 
     print(f'{cell_range} updated.')
 
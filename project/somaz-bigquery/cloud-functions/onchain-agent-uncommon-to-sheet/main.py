@@ -2,13 +2,20 @@ import os
 import requests
 import datetime
 import gspread
+from gspread.utils import a1_to_rowcol
 from google.oauth2.service_account import Credentials
 from flask import jsonify
 import time
+from sheet_helpers import open_worksheet, load_date_row_index, flush_sheet_writes, get_grid_value
 
 # Make sure to set 'DUNE_API_KEY' and 'SHEET_ID' in your environment variables.
 
-def fetch_data_from_dune():
+# Bounds on waiting for Dune, so a catch-up run finishes inside the 540s function timeout
+DUNE_POLL_INTERVAL_SECONDS = 5
+DUNE_POLL_MAX_ATTEMPTS = int(os.getenv('DUNE_POLL_MAX_ATTEMPTS', '36'))  # Status checks per execution, 3 minutes at 5s
+RUN_DEADLINE_SECONDS = int(os.getenv('RUN_DEADLINE_SECONDS', '480'))  # No new Dune execution or poll past this point of a run
+
+def fetch_data_from_dune(date, deadline):
     API_KEY = os.getenv('DUNE_API_KEY')
     QUERY_ID = ''  # Replace with your actual query ID
 
@@ -24,7 +31,7 @@ def fetch_data_from_dune():
         "parameters": [
             {
                 "key": "date",
-                "value": get_yesterdays_date_utc(),
+                "value": date,
                 "type": "datetime"
             }
         ]
@@ -40,7 +47,7 @@ def fetch_data_from_dune():
 
     # Check the status of the query execution
     DUNE_API_STATUS_ENDPOINT = f"https://api.dune.com/api/v1/execution/{execution_id}/status"
-    while True:
+    for attempt in range(DUNE_POLL_MAX_ATTEMPTS):
         status_response = requests.get(DUNE_API_STATUS_ENDPOINT, headers=headers)
         if status_response.status_code == 200:
             status_data = status_response.json()
@@ -49,7 +56,13 @@ def fetch_data_from_dune():
             elif status_data["state"] == "QUERY_STATE_FAILED":
                 print("Query execution failed.")
                 return None
-        time.sleep(5)  # Adjust the sleep time as needed
+        if time.time() + DUNE_POLL_INTERVAL_SECONDS > deadline:
+            print(f"Query execution for {date} did not finish before the run deadline.")
+            return None
+        time.sleep(DUNE_POLL_INTERVAL_SECONDS)
+    else:
+        print(f"Query execution for {date} did not finish after {DUNE_POLL_MAX_ATTEMPTS} status checks.")
+        return None
 
     # Fetch the results of the query
     DUNE_API_RESULTS_ENDPOINT = f"https://api.dune.com/api/v1/execution/{execution_id}/results"
@@ -75,90 +88,133 @@ def get_yesterdays_date_utc():
     yesterdays_date_utc = utc_now - datetime.timedelta(days=1)
     return yesterdays_date_utc.strftime('%Y-%m-%d')
 
-def find_row_for_date(worksheet, date):
-    date_column_values = worksheet.col_values(1)
-    try:
-        return date_column_values.index(date) + 1
-    except ValueError:
-        return None
-
-def write_to_sheet(worksheet, row_number, data):
+# Sheet column of each quantity in the Dune result
+QUANTITY_COLUMNS = {
+    'BC': '민팅 수량',  # Minting Quantity
+    'CB': '퀘스트 소각 수량',  # Quest Burn Quantity
+    'CG': '다오 소각 수량',  # Dao Burn Quantity
+}
+HIGHEST_PRICE_COLUMN = 'CQ'  # Highest Price(/NFT), carried forward from the previous row when missing
+
+def plan_sheet_row(row_number, data, previous_price, value_updates, cell_formats):
+    """
+    Add the values and formats of one date row to the pending writes.
+    Returns the highest price the row ends up with, so the next row can carry it forward.
+    """
     if row_number is None or row_number < 2:  # Ensure row_number is valid and not the first row
         print("Invalid row number in the sheet")
-        return
-
-    # Define the columns where data will be written, using the correct key names
-    columns = {
-        'BC': data.get('민팅 수량', 0),  # Minting Quantity
-        'CB': data.get('퀘스트 소각 수량', 0),  # Quest Burn Quantity
-        'CG': data.get('다오 소각 수량', 0),  # Dao Burn Quantity
-        # 'CQ': data.get('최고 가격(/NFT)', 0)  # Highest Price(/NFT) - Special handling below
-    }
+        return previous_price
 
-    # Update cell values and apply center alignment for regular columns
-    for col, value in columns.items():
+    # Collect the values and formats so they go out in two batched calls
+    center_format = {
+        "horizontalAlignment": "CENTER",
+        "verticalAlignment": "MIDDLE"
+    }
+    for col, key in QUANTITY_COLUMNS.items():
         cell = f'{col}{row_number}'
-        worksheet.update(cell, value)
-
-        # Set cell format to center alignment
-        worksheet.format(cell, {
-            "horizontalAlignment": "CENTER",
-            "verticalAlignment": "MIDDLE"
-        })
+        value_updates.append({'range': cell, 'values': [[data.get(key, 0)]]})
+        cell_formats.append((row_number, a1_to_rowcol(cell)[1], center_format))
 
     # Special handling for '최고 가격(/NFT)' column
-    highest_price_cell = f'CQ{row_number}'
+    highest_price_cell = f'{HIGHEST_PRICE_COLUMN}{row_number}'
     highest_price = data.get('최고 가격(/NFT)')
     if highest_price is not None:
         # Update the cell as a string if there is a value
-        worksheet.update(highest_price_cell, str(highest_price), value_input_option='USER_ENTERED')
+        highest_price = str(highest_price)
+        value_updates.append({'range': highest_price_cell, 'values': [[highest_price]]})
+    elif previous_price:
+        # Copy the value from the previous row as a string
+        highest_price = previous_price
+        value_updates.append({'range': highest_price_cell, 'values': [[highest_price]]})
     else:
-        # Directly copy the value from the previous row as a string
-        previous_row_value = worksheet.acell(f'CQ{row_number - 1}').value
-        if previous_row_value:
-            worksheet.update(highest_price_cell, previous_row_value, value_input_option='USER_ENTERED')
-        else:
-            print("Previous row has no value for highest price.")
+        print("Previous row has no value for highest price.")
 
     # Set cell format to center alignment for '최고 가격(/NFT)' column
-    worksheet.format(highest_price_cell, {
-        "horizontalAlignment": "CENTER",
-        "verticalAlignment": "MIDDLE"
-    })
+    cell_formats.append((row_number, a1_to_rowcol(highest_price_cell)[1], center_format))
+    return highest_price
+
+# Days up to yesterday that are scanned for rows a failed run left empty
+CATCH_UP_DAYS = int(os.getenv('CATCH_UP_DAYS', '7'))
+
+def find_missing_dates(worksheet, date_row_index, dates):
+    """
+    Read the target columns of the given dates in one batchGet and return the dates whose quantity
+    cells are empty, with the highest price found in each row (the row above the window included).
+    """
+    date_rows = {date: date_row_index[date] for date in dates if date in date_row_index}
+    if not date_rows:
+        return [], {}
+
+    first_row = max(1, min(date_rows.values()) - 1)
+    last_row = max(date_rows.values())
+    columns = list(QUANTITY_COLUMNS) + [HIGHEST_PRICE_COLUMN]
+    column_values = worksheet.batch_get([f'{col}{first_row}:{col}{last_row}' for col in columns])
+
+    missing_dates = [
+        date for date, row in sorted(date_rows.items(), key=lambda item: item[1])
+        if any(get_grid_value(values, row - first_row, 0) in (None, '') for values in column_values[:len(QUANTITY_COLUMNS)])
+    ]
+    row_prices = {row: get_grid_value(column_values[-1], row - first_row, 0) for row in range(first_row, last_row + 1)}
+    return missing_dates, row_prices
 
 def main(request):
     try:
-        # Fetch data from Dune Analytics
-        rows = fetch_data_from_dune()
-        if not rows:
-            error_message = "Failed to fetch data from Dune Analytics."
-            print(error_message)
-            return jsonify({'error': error_message}), 500
-
         # Set up Google Sheets access
         SERVICE_ACCOUNT_FILE = 'bigquery.json'
         creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/spreadsheets'])
         gc = gspread.authorize(creds)
         SHEET_ID = os.getenv('SHEET_ID')
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet("Somaz_Table")
-
-        # Get yesterday's date and find corresponding row in the sheet
-        yesterdays_date = get_yesterdays_date_utc()
-        row_number = find_row_for_date(worksheet, yesterdays_date)
-
-        # Convert API date to just the date part for comparison
-        for data in rows:
-            # Check if '일자' key exists in the data
-            if '일자' in data:
-                api_date = data['일자'].split(' ')[0]
-                if api_date == yesterdays_date: 
-                    write_to_sheet(worksheet, row_number, data)
+        worksheet = open_worksheet(gc, SHEET_ID, "Somaz_Table")
+        date_row_index = load_date_row_index(worksheet)
+
+        # Find the recent dates whose rows are still empty; on a normal run that is only yesterday
+        yesterday = datetime.datetime.strptime(get_yesterdays_date_utc(), '%Y-%m-%d')
+        recent_dates = [(yesterday - datetime.timedelta(days=days)).strftime('%Y-%m-%d') for days in range(CATCH_UP_DAYS - 1, -1, -1)]
+        missing_dates, row_prices = find_missing_dates(worksheet, date_row_index, recent_dates)
+        if not missing_dates:
+            success_message = "No empty rows to fill"
+            print(success_message)
+            return success_message, 200
+        print(f"Empty rows found for: {', '.join(missing_dates)}")
+
+        # Fill the rows oldest first so a missing highest price is carried forward from the row above.
+        # Each date is written as soon as its data arrives, so a run cut short keeps the days already filled.
+        run_deadline = time.time() + RUN_DEADLINE_SECONDS
+        rows_by_date = {}
+        written_dates = []
+        for date in missing_dates:
+            if date not in rows_by_date:
+                if time.time() > run_deadline:
+                    print(f"Run deadline reached, {date} and later dates are left for the next run.")
                     break
-            else:
-                print(f"Missing '일자' key in data: {data}")
+                rows = fetch_data_from_dune(date, run_deadline)
+                if not rows:
+                    print(f"Failed to fetch data from Dune Analytics for {date}.")
+                    continue
+                # Convert API date to just the date part for comparison; one result may also cover later dates
+                for data in rows:
+                    # Check if '일자' key exists in the data
+                    if '일자' in data:
+                        rows_by_date.setdefault(data['일자'].split(' ')[0], data)
+                    else:
+                        print(f"Missing '일자' key in data: {data}")
+
+            if date not in rows_by_date:
+                print(f"No Dune data for {date}")
+                continue
+            value_updates = []
+            cell_formats = []
+            row_number = date_row_index[date]
+            row_prices[row_number] = plan_sheet_row(row_number, rows_by_date[date], row_prices.get(row_number - 1), value_updates, cell_formats)
+            flush_sheet_writes(worksheet, value_updates, cell_formats)
+            written_dates.append(date)
+
+        if not written_dates:
+            error_message = "Failed to fetch data from Dune Analytics."
+            print(error_message)
+            return jsonify({'error': error_message}), 500
 
-        success_message = "Data written to sheet successfully"
+        success_message = f"Data written to sheet successfully for {', '.join(written_dates)}"
         print(success_message)
         return success_message, 200
 
@@ -167,4 +223,3 @@ def main(request):
         print(error_message)
         return jsonify({'error': error_message}), 500
 
-
@@ -5,6 +5,7 @@ import gspread
 from google.oauth2.service_account import Credentials
 import time
 from flask import jsonify
+from sheet_helpers import open_worksheet
 
 def fetch_data_from_dune():
     API_KEY = os.getenv('DUNE_API_KEY')
@@ -68,8 +69,7 @@ def main(request):
         creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/spreadsheets'])
         gc = gspread.authorize(creds)
         SHEET_ID = os.getenv('SHEET_ID')
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet("Somaz_Table(Pack)")
+        worksheet = open_worksheet(gc, SHEET_ID, "Somaz_Table(Pack)")
 
         updates = []
         for row in global_data:
@@ -5,6 +5,7 @@ import gspread
 from google.oauth2.service_account import Credentials
 from flask import jsonify
 import time
+from sheet_helpers import open_worksheet
 
 def fetch_data_from_dune():
     API_KEY = os.getenv('DUNE_API_KEY')
@@ -87,7 +88,6 @@ def write_to_sheet(worksheet, row_number, data):
         })
         time.sleep(1)
 
-
 def main(request):
     try:
         daily_data, global_data = fetch_data_from_dune()
@@ -103,8 +103,7 @@ def main(request):
         creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/spreadsheets'])
         gc = gspread.authorize(creds)
         SHEET_ID = os.getenv('SHEET_ID')
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet("[Quest]Daily&Global")
+        worksheet = open_worksheet(gc, SHEET_ID, "[Quest]Daily&Global")
 
         # Fetch all date column values at once
         date_column_values = worksheet.col_values(1)
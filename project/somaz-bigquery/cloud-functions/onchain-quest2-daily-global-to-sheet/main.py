@@ -5,6 +5,7 @@ import gspread
 from google.oauth2.service_account import Credentials
 from flask import jsonify
 import time
+from sheet_helpers import open_worksheet
 
 # Make sure to set 'DUNE_API_KEY' and 'SHEET_ID' in your environment variables.
 
@@ -132,8 +133,7 @@ def main(request):
         creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/spreadsheets'])
         gc = gspread.authorize(creds)
         SHEET_ID = os.getenv('SHEET_ID')
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet("Somaz_Table")
+        worksheet = open_worksheet(gc, SHEET_ID, "Somaz_Table")
 
         # Get yesterday's date and find corresponding row in the sheet
         yesterdays_date = get_yesterdays_date_utc()
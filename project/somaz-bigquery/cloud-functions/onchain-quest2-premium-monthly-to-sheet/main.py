@@ -6,6 +6,7 @@ import gspread
 from google.oauth2.service_account import Credentials
 from flask import jsonify
 import time
+from sheet_helpers import open_worksheet
 
 def fetch_data_from_dune():
     API_KEY = os.getenv('DUNE_API_KEY')
@@ -117,8 +118,7 @@ def main(request):
         creds = Credentials.from_service_account_file('bigquery.json', scopes=['https://www.googleapis.com/auth/spreadsheets'])
         gc = gspread.authorize(creds)
         SHEET_ID = os.getenv('SHEET_ID')
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet("[Quest]Premium")
+        worksheet = open_worksheet(gc, SHEET_ID, "[Quest]Premium")
 
         # 이전 달의 일수에 따른 범위 설정
         days_in_month = calendar.monthrange(previous_month.year, previous_month.month)[1]
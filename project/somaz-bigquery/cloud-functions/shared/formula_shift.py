@@ -0,0 +1,73 @@
+"""
+Formula row shifting and copyPaste helpers shared by the copy-formula functions.
+
+Terraform zips this file next to each function's main.py, so it is imported as a top-level
+module. To run a function locally, put this directory on PYTHONPATH.
+"""
+import re
+
+# One pass over a formula: string literals and sheet qualifiers are matched so they are skipped,
+# cell references are matched only when they are not part of a longer name or a function call
+FORMULA_TOKEN_PATTERN = re.compile(r'''
+    (?P<string>"(?:[^"]|"")*")
+  | (?P<sheet>(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)
+  | (?<![\w.$])(?P<col>\$?[A-Z]{1,3})(?P<row_abs>\$?)(?P<row>[1-9]\d*)(?![\w(])
+''', re.VERBOSE)
+
+def shift_formula_references(formula, row_offset):
+    """Move relative row references down by row_offset, leaving $-anchored rows, strings and sheet names as they are."""
+    def shift(match):
+        if match.group('col') is None or match.group('row_abs'):
+            return match.group(0)
+        new_row_number = int(match.group('row')) + row_offset
+        if new_row_number < 1:
+            return '#REF!'
+        return f"{match.group('col')}{new_row_number}"
+    return FORMULA_TOKEN_PATTERN.sub(shift, formula)
+
+def has_cell_reference(formula):
+    """Check whether the formula contains at least one cell reference."""
+    return any(match.group('col') for match in FORMULA_TOKEN_PATTERN.finditer(formula))
+
+def build_copy_paste_request(sheet_grid_id, source_row, target_row, start_col, end_col, row_count=1):
+    """Build a PASTE_FORMULA copyPaste request; the server shifts relative references for the target rows."""
+    return {
+        'copyPaste': {
+            'source': {
+                'sheetId': sheet_grid_id,
+                'startRowIndex': source_row - 1, 'endRowIndex': source_row - 1 + row_count,
+                'startColumnIndex': start_col - 1, 'endColumnIndex': end_col,
+            },
+            'destination': {
+                'sheetId': sheet_grid_id,
+                'startRowIndex': target_row - 1, 'endRowIndex': target_row - 1 + row_count,
+                'startColumnIndex': start_col - 1, 'endColumnIndex': end_col,
+            },
+            'pasteType': 'PASTE_FORMULA',
+            'pasteOrientation': 'NORMAL',
+        }
+    }
+
+def formula_paste_ranges(source_block, first_col, col_numbers, row_count):
+    """
+    Split the listed columns of a FORMULA-rendered source block into copyPaste ranges that hold only formulas,
+    as (row_offset, row_count, start_col, end_col). Runs of columns with a formula in every source row are
+    pasted whole; in the other columns each formula cell is pasted on its own, so the constants and blanks
+    of the source rows are never copied.
+    """
+    def is_formula(row_index, col_num):
+        source_row = source_block[row_index] if row_index < len(source_block) else []
+        value = source_row[col_num - first_col] if col_num - first_col < len(source_row) else None
+        return isinstance(value, str) and value.startswith('=')
+
+    full_column_runs = []
+    single_cells = []
+    for col_num in sorted(set(col_numbers)):
+        formula_rows = [row_index for row_index in range(row_count) if is_formula(row_index, col_num)]
+        if len(formula_rows) < row_count:
+            single_cells.extend((row_index, 1, col_num, col_num) for row_index in formula_rows)
+        elif full_column_runs and full_column_runs[-1][1] == col_num - 1:
+            full_column_runs[-1][1] = col_num
+        else:
+            full_column_runs.append([col_num, col_num])
+    return [(0, row_count, start_col, end_col) for start_col, end_col in full_column_runs] + single_cells
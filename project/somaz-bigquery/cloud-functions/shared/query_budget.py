@@ -0,0 +1,57 @@
+"""
+Bytes budget guard shared by the BigQuery sheet functions.
+
+Every sheet query is dry-run first; its estimated bytes are checked against a budget and
+recorded in QUERY_HISTORY_TABLE. Terraform zips this file next to each function's main.py.
+"""
+import os
+import json
+import logging
+from datetime import datetime
+from google.cloud import bigquery
+
+# Cloud Functions sets K_SERVICE to the deployed function name
+FUNCTION_NAME = os.getenv('K_SERVICE', 'local')
+QUERY_BYTES_BUDGET = int(os.getenv('QUERY_BYTES_BUDGET', '0'))  # Default per-query budget in bytes, 0 disables the check
+QUERY_BYTES_BUDGETS = json.loads(os.getenv('QUERY_BYTES_BUDGETS', '{}'))  # Per-query budgets keyed by query id
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', 'warn')  # 'warn' runs the query anyway, 'refuse' raises
+
+def record_query_bytes(client, query_id, total_bytes):
+    """Log a dry-run estimate and append it to QUERY_HISTORY_TABLE, if one is configured."""
+    logging.info(f"Dry run {FUNCTION_NAME}/{query_id}: {total_bytes} bytes")
+    history_table = os.getenv('QUERY_HISTORY_TABLE')
+    if not history_table:
+        return
+    row = {
+        'recorded_at': datetime.utcnow().isoformat(),
+        'function_name': FUNCTION_NAME,
+        'query_id': query_id,
+        'total_bytes_processed': total_bytes,
+    }
+    try:
+        errors = client.insert_rows_json(history_table, [row])
+        if errors:
+            logging.warning(f"Could not record query bytes for {query_id}: {errors}")
+    except Exception as e:
+        logging.warning(f"Could not record query bytes for {query_id}: {e}")
+
+def run_query(client, query_id, sql, job_config=None):
+    """Dry-run a query, check its estimated bytes against the budget, then submit it and return the job."""
+    if job_config is not None:
+        dry_run_config = bigquery.QueryJobConfig.from_api_repr(job_config.to_api_repr())
+    else:
+        dry_run_config = bigquery.QueryJobConfig()
+    dry_run_config.dry_run = True
+    dry_run_config.use_query_cache = False
+
+    total_bytes = client.query(sql, job_config=dry_run_config).total_bytes_processed or 0
+    record_query_bytes(client, query_id, total_bytes)
+
+    budget = QUERY_BYTES_BUDGETS.get(query_id, QUERY_BYTES_BUDGET)
+    if budget and total_bytes > budget:
+        message = f"{FUNCTION_NAME}/{query_id} would process {total_bytes} bytes, over its budget of {budget} bytes"
+        if QUERY_BUDGET_MODE == 'refuse':
+            raise Exception(message)
+        logging.warning(message)
+
+    return client.query(sql, job_config=job_config)
@@ -0,0 +1,203 @@
+"""
+Google Sheets helpers shared by the sheet sync functions.
+
+Terraform zips this file next to each function's main.py, so it is imported as a top-level
+module. To run a function locally, put this directory on PYTHONPATH.
+"""
+import os
+import time
+import json
+import logging
+from datetime import datetime
+import gspread
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+class MetadataSpreadsheet(gspread.Spreadsheet):
+    """A Spreadsheet that keeps the metadata it fetches, so the sheet list needs no second request."""
+    metadata = None
+
+    def fetch_sheet_metadata(self, params=None):
+        self.metadata = super().fetch_sheet_metadata(params)
+        return self.metadata
+
+# Worksheet handles, whose properties carry the sheetId, title and grid size, reused across warm invocations
+_sheet_handle_cache = {}
+SHEET_HANDLE_TTL_SECONDS = 600
+
+def open_worksheet(gc, sheet_id, sheet_name):
+    """Return a worksheet handle, fetching the spreadsheet metadata with one request at most once per TTL."""
+    entry = _sheet_handle_cache.get(sheet_id)
+    if entry is None or time.time() - entry['fetched_at'] > SHEET_HANDLE_TTL_SECONDS:
+        # gspread 4+ fetches the metadata while constructing the spreadsheet, 3.x only on demand
+        spreadsheet = MetadataSpreadsheet(gc, {'id': sheet_id})
+        metadata = spreadsheet.metadata or spreadsheet.fetch_sheet_metadata()
+        entry = {
+            'fetched_at': time.time(),
+            'worksheets': {
+                sheet['properties']['title']: gspread.Worksheet(spreadsheet, sheet['properties'])
+                for sheet in metadata['sheets']
+            },
+        }
+        _sheet_handle_cache[sheet_id] = entry
+
+    worksheet = entry['worksheets'].get(sheet_name)
+    if worksheet is None:
+        # The sheet may have been added or renamed since the metadata was cached
+        _sheet_handle_cache.pop(sheet_id, None)
+        raise gspread.exceptions.WorksheetNotFound(sheet_name)
+    return worksheet
+
+def normalize_date(value):
+    """Normalize a sheet or query date value to a 'YYYY-MM-DD' string."""
+    value = str(value).strip()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return value
+
+def build_date_row_index(worksheet):
+    """Read column A once and map each normalized date string to its row number."""
+    date_row_index = {}
+    for row, value in enumerate(worksheet.col_values(1), start=1):
+        if value:
+            date_row_index.setdefault(normalize_date(value), row)
+    return date_row_index
+
+# Date indexes kept in memory across warm invocations, keyed by spreadsheet and worksheet.
+# An entry is trusted without any read until it is older than DATE_INDEX_TTL_SECONDS.
+_date_row_index_cache = {}
+DATE_INDEX_TTL_SECONDS = int(os.getenv('DATE_INDEX_TTL_SECONDS', '600'))
+
+def load_date_row_index(worksheet):
+    """Return the date index for a worksheet, reading column A at most once per TTL."""
+    cache_key = (worksheet.spreadsheet.id, worksheet.title)
+    entry = _date_row_index_cache.get(cache_key)
+    if entry is None or time.time() - entry['fetched_at'] > DATE_INDEX_TTL_SECONDS:
+        entry = {'fetched_at': time.time(), 'index': build_date_row_index(worksheet)}
+        _date_row_index_cache[cache_key] = entry
+    return dict(entry['index'])
+
+def append_date_row(worksheet, date_row_index, date):
+    """Write a date into the next empty row of column A and record it in the index and its cached entry."""
+    row = max(date_row_index.values(), default=0) + 1
+    worksheet.update_cell(row, 1, date)
+    date_row_index[normalize_date(date)] = row
+    entry = _date_row_index_cache.get((worksheet.spreadsheet.id, worksheet.title))
+    if entry:
+        entry['index'][normalize_date(date)] = row
+    return row
+
+def merge_cell_rects(cells):
+    """Merge 1-based (row, col) cells into rectangles of neighbouring cells.
+
+    Returns (start_row, end_row, start_col, end_col) tuples.
+    """
+    # Join neighbouring columns of the same row into runs
+    runs = []
+    for row, col in sorted(cells):
+        if runs and runs[-1][0] == row and runs[-1][2] == col - 1:
+            runs[-1][2] = col
+        else:
+            runs.append([row, col, col])
+
+    # Stack runs that span the same columns on consecutive rows into rectangles
+    open_rects = {}
+    rects = []
+    for row, start_col, end_col in runs:
+        rect = open_rects.get((start_col, end_col))
+        if rect and rect[1] == row - 1:
+            rect[1] = row
+        else:
+            rect = [row, row, start_col, end_col]
+            open_rects[(start_col, end_col)] = rect
+            rects.append(rect)
+    return [tuple(rect) for rect in rects]
+
+def build_value_blocks(cell_values):
+    """Merge cell values, a dict from (row, col) to value, into rectangular value ranges."""
+    return [
+        {
+            'range': f"{rowcol_to_a1(start_row, start_col)}:{rowcol_to_a1(end_row, end_col)}",
+            'values': [
+                [cell_values[(row, col)] for col in range(start_col, end_col + 1)]
+                for row in range(start_row, end_row + 1)
+            ]
+        }
+        for start_row, end_row, start_col, end_col in merge_cell_rects(cell_values)
+    ]
+
+def coalesce_format_requests(sheet_id, cell_formats):
+    """Merge adjacent cells that share a format into rectangular repeatCell requests.
+
+    cell_formats is a list of (row, col, format) tuples with 1-based row and column numbers.
+    """
+    cells_by_format = {}
+    for row, col, cell_format in cell_formats:
+        key = json.dumps(cell_format, sort_keys=True)
+        cells_by_format.setdefault(key, set()).add((row, col))
+
+    format_requests = []
+    for key, cells in cells_by_format.items():
+        cell_format = json.loads(key)
+        for start_row, end_row, start_col, end_col in merge_cell_rects(cells):
+            format_requests.append({
+                "repeatCell": {
+                    "range": {
+                        "sheetId": sheet_id,
+                        "startRowIndex": start_row - 1,
+                        "endRowIndex": end_row,
+                        "startColumnIndex": start_col - 1,
+                        "endColumnIndex": end_col
+                    },
+                    "cell": {"userEnteredFormat": cell_format},
+                    "fields": "userEnteredFormat(%s)" % ','.join(cell_format.keys())
+                }
+            })
+    return format_requests
+
+def flush_sheet_writes(worksheet, value_updates, cell_formats):
+    """Send collected values in one values.batchUpdate and their formats in one spreadsheets.batchUpdate."""
+    if value_updates and os.getenv('SYNC_MODE', 'full') == 'diff':
+        value_updates, cell_formats = drop_unchanged_updates(worksheet, value_updates, cell_formats)
+    if value_updates:
+        worksheet.batch_update(value_updates, value_input_option='USER_ENTERED')
+    format_requests = coalesce_format_requests(worksheet.id, cell_formats)
+    if format_requests:
+        worksheet.spreadsheet.batch_update({"requests": format_requests})
+
+def drop_unchanged_updates(worksheet, value_updates, cell_formats):
+    """
+    Read the target ranges in one batchGet and compare them cell by cell.
+    Returns value ranges covering only the changed cells, merged into rectangles, and the formats of those cells.
+    """
+    current_ranges = worksheet.batch_get([update['range'] for update in value_updates], value_render_option='UNFORMATTED_VALUE')
+
+    changed_cells = {}
+    skipped_count = 0
+    for update, current in zip(value_updates, current_ranges):
+        start_row, start_col = a1_to_rowcol(update['range'].split(':')[0])
+        for row_offset, new_row in enumerate(update['values']):
+            for col_offset, new_value in enumerate(new_row):
+                if values_match(get_grid_value(current, row_offset, col_offset), new_value):
+                    skipped_count += 1
+                else:
+                    changed_cells[(start_row + row_offset, start_col + col_offset)] = new_value
+
+    changed_formats = [cell_format for cell_format in cell_formats if (cell_format[0], cell_format[1]) in changed_cells]
+    logging.info(f"Diff sync: {len(changed_cells)} cells changed, {skipped_count} unchanged cells skipped")
+    return build_value_blocks(changed_cells), changed_formats
+
+def get_grid_value(values, row_offset, col_offset):
+    """Return a value from a row-major grid, or '' where the API trimmed empty cells."""
+    if row_offset < len(values) and col_offset < len(values[row_offset]):
+        return values[row_offset][col_offset]
+    return ''
+
+def values_match(old_value, new_value):
+    """Compare a sheet value with a new value, treating blanks alike and numbers by value."""
+    if old_value in (None, '') or new_value in (None, ''):
+        return old_value in (None, '') and new_value in (None, '')
+    try:
+        return float(old_value) == float(new_value)
+    except (TypeError, ValueError):
+        return str(old_value) == str(new_value)
@@ -6,13 +6,16 @@ resource "null_resource" "bigquery_sheet_zip_retention_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/bigquery-to-sheet-retention
       zip -r bigquery-to-sheet-retention.zip main.py requirements.txt bigquery-dsp.json
+      zip -j bigquery-to-sheet-retention.zip ../shared/sheet_helpers.py ../shared/query_budget.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-retention/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/bigquery-to-sheet-retention/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-retention/bigquery-dsp.json")
+    main_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-retention/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/bigquery-to-sheet-retention/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-retention/bigquery-dsp.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
+    query_budget_content_hash  = filesha256("./cloud-functions/shared/query_budget.py")
   }
 }
 
@@ -44,7 +47,11 @@ resource "google_cloudfunctions_function" "bigquery_sheet_retention_function" {
   entry_point           = "update_retention_datas_in_sheets" # Function name in Python code
 
   environment_variables = {
-    SHEET_ID = "" # Replace with your Google Sheet ID
+    SHEET_ID            = "" # Replace with your Google Sheet ID
+    QUERY_CACHE_BUCKET  = google_storage_bucket.cloud_function_storage.name # Same-day retries reuse the EXTERNAL_QUERY result
+    QUERY_HISTORY_TABLE = "${var.project}.mongodb_dataset.query_bytes_history"
+    QUERY_BYTES_BUDGET  = 53687091200 # 50 GiB per query, only warns unless QUERY_BUDGET_MODE = "refuse"
+    SYNC_MODE           = "diff" # "full" rewrites every cell, "diff" writes only changed cells
   }
 }
 
@@ -77,13 +84,16 @@ resource "null_resource" "bigquery_sheet_zip_wallet_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/bigquery-to-sheet-wallet
       zip -r bigquery-to-sheet-wallet.zip main.py requirements.txt bigquery-luxon.json
+      zip -j bigquery-to-sheet-wallet.zip ../shared/sheet_helpers.py ../shared/query_budget.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-wallet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/bigquery-to-sheet-wallet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-wallet/bigquery-luxon.json")
+    main_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-wallet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/bigquery-to-sheet-wallet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-wallet/bigquery-luxon.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
+    query_budget_content_hash  = filesha256("./cloud-functions/shared/query_budget.py")
   }
 }
 
@@ -115,7 +125,9 @@ resource "google_cloudfunctions_function" "bigquery_sheet_wallet_function" {
   entry_point           = "update_wallet_datas_in_sheets" # Function name in Python code
 
   environment_variables = {
-    SHEET_ID = "" # Replace with your Google Sheet ID
+    SHEET_ID            = "" # Replace with your Google Sheet ID
+    QUERY_HISTORY_TABLE = "${var.project}.mongodb_dataset.query_bytes_history"
+    QUERY_BYTES_BUDGET  = 53687091200 # 50 GiB per query, only warns unless QUERY_BUDGET_MODE = "refuse"
   }
 }
 
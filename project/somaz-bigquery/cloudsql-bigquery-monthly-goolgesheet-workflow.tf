@@ -6,13 +6,16 @@ resource "null_resource" "bigquery_sheet_zip_tier_badge_monthly_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/bigquery-to-sheet-tier-badge-monthly
       zip -r bigquery-to-sheet-tier-badge-monthly.zip main.py requirements.txt bigquery-luxon.json
+      zip -j bigquery-to-sheet-tier-badge-monthly.zip ../shared/sheet_helpers.py ../shared/query_budget.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-tier-badge-monthly/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/bigquery-to-sheet-tier-badge-monthly/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-tier-badge-monthly/bigquery-luxon.json")
+    main_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-tier-badge-monthly/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/bigquery-to-sheet-tier-badge-monthly/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-tier-badge-monthly/bigquery-luxon.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
+    query_budget_content_hash  = filesha256("./cloud-functions/shared/query_budget.py")
   }
 }
 
@@ -44,7 +47,9 @@ resource "google_cloudfunctions_function" "bigquery_sheet_tier_badge_monthly_fun
   entry_point           = "update_kpi_table_pack" # Function name in Python code
 
   environment_variables = {
-    SHEET_ID = ""
+    SHEET_ID            = ""
+    QUERY_HISTORY_TABLE = "${var.project}.mongodb_dataset.query_bytes_history"
+    QUERY_BYTES_BUDGET  = 53687091200 # 50 GiB per query, only warns unless QUERY_BUDGET_MODE = "refuse"
   }
 }
 
@@ -6,13 +6,15 @@ resource "null_resource" "copy_formula_sheet_zip_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/copy-formula-to-sheet
       zip -r copy-formula-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j copy-formula-to-sheet.zip ../shared/formula_shift.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/copy-formula-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/copy-formula-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/copy-formula-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/copy-formula-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/copy-formula-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/copy-formula-to-sheet/bigquery.json")
+    formula_shift_content_hash = filesha256("./cloud-functions/shared/formula_shift.py")
   }
 }
 
@@ -44,7 +46,9 @@ resource "google_cloudfunctions_function" "copy_formula_sheet_function" {
   entry_point           = "propagate_formulas" # Function name in Python code
 
   environment_variables = {
-    SHEET_ID = "" # Replace with your Google Sheet ID
+    SHEET_ID             = "" # Replace with your Google Sheet ID
+    PROPAGATION_MODE     = "server"
+    COMBINED_PROPAGATION = "true" # Also runs the retention and monthly propagations, whose own schedulers stay until this is proven
   }
 }
 
@@ -77,13 +81,16 @@ resource "null_resource" "copy_formula_retention_sheet_zip_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/copy-formula-retention-to-sheet
       zip -r copy-formula-retention-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j copy-formula-retention-to-sheet.zip ../shared/sheet_helpers.py ../shared/formula_shift.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/copy-formula-retention-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/copy-formula-retention-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/copy-formula-retention-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/copy-formula-retention-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/copy-formula-retention-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/copy-formula-retention-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
+    formula_shift_content_hash = filesha256("./cloud-functions/shared/formula_shift.py")
   }
 }
 
@@ -121,6 +128,7 @@ resource "google_cloudfunctions_function" "copy_formula_retention_sheet_function
 
 
 ## cloud_scheduler
+# Kept alongside the combined pass of copy_formula_sheet_job until that pass has been proven; both runs paste the same formulas
 resource "google_cloud_scheduler_job" "copy_formula_retention_sheet_job" {
   depends_on = [google_cloudfunctions_function.copy_formula_retention_sheet_function]
 
@@ -148,13 +156,16 @@ resource "null_resource" "copy_formula_monthly_sheet_zip_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/copy-formula-monthly-to-sheet
       zip -r copy-formula-monthly-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j copy-formula-monthly-to-sheet.zip ../shared/sheet_helpers.py ../shared/formula_shift.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/copy-formula-monthly-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/copy-formula-monthly-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/copy-formula-monthly-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/copy-formula-monthly-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/copy-formula-monthly-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/copy-formula-monthly-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
+    formula_shift_content_hash = filesha256("./cloud-functions/shared/formula_shift.py")
   }
 }
 
@@ -186,12 +197,14 @@ resource "google_cloudfunctions_function" "copy_formula_monthly_sheet_function"
   entry_point           = "propagate_formulas" # Python 코드 내 함수 이름
 
   environment_variables = {
-    SHEET_ID = "" # Replace with your Google Sheet ID
+    SHEET_ID         = "" # Replace with your Google Sheet ID
+    PROPAGATION_MODE = "server"
   }
 }
 
 
 ## cloud_scheduler
+# Kept alongside the combined pass of copy_formula_sheet_job until that pass has been proven; both runs paste the same formulas
 resource "google_cloud_scheduler_job" "copy_formula_monthly_sheet_job" {
   depends_on = [google_cloudfunctions_function.copy_formula_monthly_sheet_function]
 
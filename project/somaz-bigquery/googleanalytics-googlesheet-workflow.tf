@@ -6,13 +6,15 @@ resource "null_resource" "analytics_sheet_new_web_visitors_zip_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/analytics-to-sheet-new-web-visitors
       zip -r analytics-to-sheet-new-web-visitors.zip main.py requirements.txt bigquery.json
+      zip -j analytics-to-sheet-new-web-visitors.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -78,13 +80,15 @@ resource "null_resource" "analytics_sheet_new_web_visitors_country_zip_cloudfunc
     command = <<EOT
       cd ./cloud-functions/analytics-to-sheet-new-web-visitors-country
       zip -r analytics-to-sheet-new-web-visitors-country.zip main.py requirements.txt bigquery.json
+      zip -j analytics-to-sheet-new-web-visitors-country.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors-country/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors-country/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors-country/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors-country/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors-country/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/analytics-to-sheet-new-web-visitors-country/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -6,13 +6,15 @@ resource "null_resource" "matic_value_sheet_zip_cloudfunction" {
     command = <<EOT
       cd ./cloud-functions/matic-value-to-sheet
       zip -r matic-value-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j matic-value-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/matic-value-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/matic-value-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/matic-value-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/matic-value-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/matic-value-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/matic-value-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
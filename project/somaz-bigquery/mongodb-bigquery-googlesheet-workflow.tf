@@ -26,6 +26,26 @@ resource "google_bigquery_dataset" "mongodb_dataset" {
   }
 }
 
+## Dry-run bytes of every sheet query, appended by the sheet functions before each run
+resource "google_bigquery_table" "query_bytes_history" {
+  dataset_id          = google_bigquery_dataset.mongodb_dataset.dataset_id
+  table_id            = "query_bytes_history"
+  deletion_protection = false
+  labels              = local.default_labels
+
+  time_partitioning {
+    type  = "DAY"
+    field = "recorded_at"
+  }
+
+  schema = jsonencode([
+    { name = "recorded_at", type = "TIMESTAMP", mode = "REQUIRED" },
+    { name = "function_name", type = "STRING", mode = "REQUIRED" },
+    { name = "query_id", type = "STRING", mode = "REQUIRED" },
+    { name = "total_bytes_processed", type = "INT64", mode = "REQUIRED" }
+  ])
+}
+
 ## cloudfunction source Bucket
 resource "google_storage_bucket" "cloud_function_storage" {
 
@@ -36,6 +56,13 @@ resource "google_storage_bucket" "cloud_function_storage" {
   force_destroy               = true
 }
 
+## The retention sheet function caches its query results under query-results/ in this bucket
+resource "google_storage_bucket_iam_member" "cloud_function_storage_query_cache" {
+  bucket = google_storage_bucket.cloud_function_storage.name
+  role   = "roles/storage.objectAdmin"
+  member = "serviceAccount:${module.service_accounts_bigquery.email}"
+}
+
 ##########################################################################################################
 
 ## mongodb -> bigquery table workflow
@@ -154,7 +181,8 @@ resource "google_cloudfunctions_function" "bigquery_deduplication_function" {
   service_account_email = module.service_accounts_bigquery.email
 
   environment_variables = {
-    PROJECT_ID = var.project
+    PROJECT_ID                 = var.project
+    PARSED_EVENTS_REFRESH_DAYS = 3 # Minimum recent days of production-mongodb-parsed-events rebuilt per run; the current month is always rebuilt
   }
 }
 
@@ -185,14 +213,18 @@ resource "null_resource" "bigquery_sheet_zip_simple_cloudfunction" {
   provisioner "local-exec" {
     command = <<EOT
       cd ./cloud-functions/bigquery-to-sheet-simple
-      zip -r bigquery-to-sheet-simple.zip main.py requirements.txt bigquery.json
+      zip -r bigquery-to-sheet-simple.zip main.py query_templates.py requirements.txt bigquery.json
+      zip -j bigquery-to-sheet-simple.zip ../shared/sheet_helpers.py ../shared/query_budget.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-simple/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/bigquery-to-sheet-simple/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-simple/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-simple/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/bigquery-to-sheet-simple/requirements.txt")
+    templates_content_hash     = filesha256("./cloud-functions/bigquery-to-sheet-simple/query_templates.py")
+    json_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-simple/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
+    query_budget_content_hash  = filesha256("./cloud-functions/shared/query_budget.py")
   }
 }
 
@@ -224,8 +256,10 @@ resource "google_cloudfunctions_function" "bigquery_sheet_simple_function" {
   entry_point           = "update_data_in_sheets" # Python 코드 내 함수 이름
 
   environment_variables = {
-    BIGQUERY_TABLE = "${var.project}.mongodb_dataset.mongodb-internal-table",
-    SHEET_ID       = "" # Replace with your Google Sheet ID
+    BIGQUERY_TABLE      = "${var.project}.mongodb_dataset.mongodb-internal-table",
+    SHEET_ID            = "" # Replace with your Google Sheet ID
+    QUERY_HISTORY_TABLE = "${var.project}.mongodb_dataset.query_bytes_history"
+    QUERY_BYTES_BUDGET  = 53687091200 # 50 GiB per query, only warns unless QUERY_BUDGET_MODE = "refuse"
   }
 }
 
@@ -257,14 +291,18 @@ resource "null_resource" "bigquery_sheet_zip_multiple_cloudfunction" {
   provisioner "local-exec" {
     command = <<EOT
       cd ./cloud-functions/bigquery-to-sheet-multiple
-      zip -r bigquery-to-sheet-multiple.zip main.py requirements.txt bigquery.json
+      zip -r bigquery-to-sheet-multiple.zip main.py query_templates.py requirements.txt bigquery.json
+      zip -j bigquery-to-sheet-multiple.zip ../shared/sheet_helpers.py ../shared/query_budget.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-multiple/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/bigquery-to-sheet-multiple/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/bigquery-to-sheet-simple/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-multiple/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/bigquery-to-sheet-multiple/requirements.txt")
+    templates_content_hash     = filesha256("./cloud-functions/bigquery-to-sheet-multiple/query_templates.py")
+    json_content_hash          = filesha256("./cloud-functions/bigquery-to-sheet-simple/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
+    query_budget_content_hash  = filesha256("./cloud-functions/shared/query_budget.py")
   }
 }
 
@@ -296,8 +334,10 @@ resource "google_cloudfunctions_function" "bigquery_sheet_multiple_function" {
   entry_point           = "update_multiple_datas_in_sheets" # Function name in Python code
 
   environment_variables = {
-    BIGQUERY_TABLE = "${var.project}.mongodb_dataset.mongodb-internal-table",
-    SHEET_ID       = "" # Replace with your Google Sheet ID
+    BIGQUERY_TABLE      = "${var.project}.mongodb_dataset.mongodb-internal-table",
+    SHEET_ID            = "" # Replace with your Google Sheet ID
+    QUERY_HISTORY_TABLE = "${var.project}.mongodb_dataset.query_bytes_history"
+    QUERY_BYTES_BUDGET  = 53687091200 # 50 GiB per query, only warns unless QUERY_BUDGET_MODE = "refuse"
   }
 }
 
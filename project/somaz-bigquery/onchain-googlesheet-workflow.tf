@@ -6,13 +6,15 @@ resource "null_resource" "onchain_agent_common_sheet_zip_cloud_function" {
     command = <<EOT
       cd ./cloud-functions/onchain-agent-common-to-sheet
       zip -r onchain-agent-common-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-agent-common-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-agent-common-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-agent-common-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-agent-common-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-agent-common-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-agent-common-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-agent-common-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -42,8 +44,11 @@ resource "google_cloudfunctions_function" "onchain_agent_common_sheet_function"
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID               = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY           = "" # Replace with your Dune API KEY
+    CATCH_UP_DAYS          = 7 # Empty rows within this many days are refilled on the next run
+    DUNE_POLL_MAX_ATTEMPTS = 36 # Status checks per Dune execution, 5s apart
+    RUN_DEADLINE_SECONDS   = 480 # Dates not fetched by then are left for the next run, inside the 540s timeout
   }
 }
 
@@ -75,13 +80,15 @@ resource "null_resource" "onchain_agent_uncommon_sheet_zip_cloud_function" {
     command = <<EOT
       cd ./cloud-functions/onchain-agent-uncommon-to-sheet
       zip -r onchain-agent-uncommon-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-agent-uncommon-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-agent-uncommon-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-agent-uncommon-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-agent-uncommon-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-agent-uncommon-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-agent-uncommon-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-agent-uncommon-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -111,8 +118,11 @@ resource "google_cloudfunctions_function" "onchain_agent_uncommon_sheet_function
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID               = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY           = "" # Replace with your Dune API KEY
+    CATCH_UP_DAYS          = 7 # Empty rows within this many days are refilled on the next run
+    DUNE_POLL_MAX_ATTEMPTS = 36 # Status checks per Dune execution, 5s apart
+    RUN_DEADLINE_SECONDS   = 480 # Dates not fetched by then are left for the next run, inside the 540s timeout
   }
 }
 
@@ -144,13 +154,15 @@ resource "null_resource" "onchain_agent_rare_sheet_zip_cloud_function" {
     command = <<EOT
       cd ./cloud-functions/onchain-agent-rare-to-sheet
       zip -r onchain-agent-rare-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-agent-rare-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-agent-rare-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-agent-rare-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-agent-rare-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-agent-rare-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-agent-rare-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-agent-rare-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -180,8 +192,11 @@ resource "google_cloudfunctions_function" "onchain_agent_rare_sheet_function" {
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID               = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY           = "" # Replace with your Dune API KEY
+    CATCH_UP_DAYS          = 7 # Empty rows within this many days are refilled on the next run
+    DUNE_POLL_MAX_ATTEMPTS = 36 # Status checks per Dune execution, 5s apart
+    RUN_DEADLINE_SECONDS   = 480 # Dates not fetched by then are left for the next run, inside the 540s timeout
   }
 }
 
@@ -213,13 +228,15 @@ resource "null_resource" "onchain_agent_epic_sheet_zip_cloud_function" {
     command = <<EOT
       cd ./cloud-functions/onchain-agent-epic-to-sheet
       zip -r onchain-agent-epic-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-agent-epic-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-agent-epic-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-agent-epic-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-agent-epic-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-agent-epic-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-agent-epic-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-agent-epic-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -249,8 +266,11 @@ resource "google_cloudfunctions_function" "onchain_agent_epic_sheet_function" {
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID               = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY           = "" # Replace with your Dune API KEY
+    CATCH_UP_DAYS          = 7 # Empty rows within this many days are refilled on the next run
+    DUNE_POLL_MAX_ATTEMPTS = 36 # Status checks per Dune execution, 5s apart
+    RUN_DEADLINE_SECONDS   = 480 # Dates not fetched by then are left for the next run, inside the 540s timeout
   }
 }
 
@@ -282,13 +302,15 @@ resource "null_resource" "onchain_agent_legend_sheet_zip_cloud_function" {
     command = <<EOT
       cd ./cloud-functions/onchain-agent-legend-to-sheet
       zip -r onchain-agent-legend-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-agent-legend-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-agent-legend-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-agent-legend-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-agent-legend-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-agent-legend-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-agent-legend-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-agent-legend-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -318,8 +340,11 @@ resource "google_cloudfunctions_function" "onchain_agent_legend_sheet_function"
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID               = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY           = "" # Replace with your Dune API KEY
+    CATCH_UP_DAYS          = 7 # Empty rows within this many days are refilled on the next run
+    DUNE_POLL_MAX_ATTEMPTS = 36 # Status checks per Dune execution, 5s apart
+    RUN_DEADLINE_SECONDS   = 480 # Dates not fetched by then are left for the next run, inside the 540s timeout
   }
 }
 
@@ -351,13 +376,15 @@ resource "null_resource" "onchain_pack_basic_epic1_sheet_zip_cloud_function" {
     command = <<EOT
       cd ./cloud-functions/onchain-pack-basic-epic1-to-sheet
       zip -r onchain-pack-basic-epic1-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-pack-basic-epic1-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-pack-basic-epic1-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-pack-basic-epic1-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-pack-basic-epic1-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-pack-basic-epic1-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-pack-basic-epic1-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-pack-basic-epic1-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -387,8 +414,8 @@ resource "google_cloudfunctions_function" "onchain_pack_basic_epic1_sheet_functi
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID     = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY = "" # Replace with your Dune API KEY
   }
 }
 
@@ -420,13 +447,15 @@ resource "null_resource" "onchain_materials_dp_chip_sheet_zip_cloud_function" {
     command = <<EOT
       cd ./cloud-functions/onchain-materials-dp-chip-to-sheet
       zip -r onchain-materials-dp-chip-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-materials-dp-chip-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-materials-dp-chip-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-materials-dp-chip-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-materials-dp-chip-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-materials-dp-chip-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-materials-dp-chip-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-materials-dp-chip-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -456,8 +485,8 @@ resource "google_cloudfunctions_function" "onchain_materials_dp_chip_sheet_funct
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID     = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY = "" # Replace with your Dune API KEY
   }
 }
 
@@ -489,13 +518,15 @@ resource "null_resource" "onchain_materials_skill_exchange_ticket_sheet_zip_clou
     command = <<EOT
       cd ./cloud-functions/onchain-materials-skill-exchange-ticket-to-sheet
       zip -r onchain-materials-skill-exchange-ticket-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-materials-skill-exchange-ticket-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-materials-skill-exchange-ticket-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-materials-skill-exchange-ticket-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-materials-skill-exchange-ticket-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-materials-skill-exchange-ticket-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-materials-skill-exchange-ticket-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-materials-skill-exchange-ticket-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -525,8 +556,8 @@ resource "google_cloudfunctions_function" "onchain_materials_skill_exchange_tick
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID     = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY = "" # Replace with your Dune API KEY
   }
 }
 
@@ -558,13 +589,15 @@ resource "null_resource" "onchain_quest2_daily_global_sheet_zip_cloud_function"
     command = <<EOT
       cd ./cloud-functions/onchain-quest2-daily-global-to-sheet
       zip -r onchain-quest2-daily-global-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-quest2-daily-global-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-quest2-daily-global-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-quest2-daily-global-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-quest2-daily-global-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-quest2-daily-global-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-quest2-daily-global-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-quest2-daily-global-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -594,8 +627,8 @@ resource "google_cloudfunctions_function" "onchain_quest2_daily_global_sheet_fun
   entry_point           = "main"
 
   environment_variables = {
-    SHEET_ID       = "" # Replace with your Google Sheet ID
-    DUNE_API_KEY   = "" # Replace with your Dune API KEY
+    SHEET_ID     = "" # Replace with your Google Sheet ID
+    DUNE_API_KEY = "" # Replace with your Dune API KEY
   }
 }
 
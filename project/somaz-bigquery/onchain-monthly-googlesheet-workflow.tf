@@ -6,13 +6,15 @@ resource "null_resource" "onchain_quest2_daily_global_monthly_sheet_zip_cloud_fu
     command = <<EOT
       cd ./cloud-functions/onchain-quest2-daily-global-monthly-to-sheet
       zip -r onchain-quest2-daily-global-monthly-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-quest2-daily-global-monthly-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-quest2-daily-global-monthly-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-quest2-daily-global-monthly-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-quest2-daily-global-monthly-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-quest2-daily-global-monthly-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-quest2-daily-global-monthly-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-quest2-daily-global-monthly-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -75,13 +77,15 @@ resource "null_resource" "onchain_quest2_weekly_monthly_sheet_zip_cloud_function
     command = <<EOT
       cd ./cloud-functions/onchain-quest2-weekly-monthly-to-sheet
       zip -r onchain-quest2-weekly-monthly-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-quest2-weekly-monthly-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-quest2-weekly-monthly-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-quest2-weekly-monthly-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-quest2-weekly-monthly-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-quest2-weekly-monthly-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-quest2-weekly-monthly-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-quest2-weekly-monthly-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -144,13 +148,15 @@ resource "null_resource" "onchain_quest2_premium_monthly_sheet_zip_cloud_functio
     command = <<EOT
       cd ./cloud-functions/onchain-quest2-premium-monthly-to-sheet
       zip -r onchain-quest2-premium-monthly-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-quest2-premium-monthly-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-quest2-premium-monthly-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-quest2-premium-monthly-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-quest2-premium-monthly-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-quest2-premium-monthly-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-quest2-premium-monthly-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-quest2-premium-monthly-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -213,13 +219,15 @@ resource "null_resource" "onchain_pack_contribution_compensation_monthly_sheet_z
     command = <<EOT
       cd ./cloud-functions/onchain-pack-contribution-compensation-monthly-to-sheet
       zip -r onchain-pack-contribution-compensation-monthly-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-pack-contribution-compensation-monthly-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-pack-contribution-compensation-monthly-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-pack-contribution-compensation-monthly-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-pack-contribution-compensation-monthly-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-pack-contribution-compensation-monthly-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-pack-contribution-compensation-monthly-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-pack-contribution-compensation-monthly-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 
@@ -282,13 +290,15 @@ resource "null_resource" "onchain_pack_airdrop_monthly_sheet_zip_cloud_function"
     command = <<EOT
       cd ./cloud-functions/onchain-pack-airdrop-monthly-to-sheet
       zip -r onchain-pack-airdrop-monthly-to-sheet.zip main.py requirements.txt bigquery.json
+      zip -j onchain-pack-airdrop-monthly-to-sheet.zip ../shared/sheet_helpers.py
     EOT
   }
 
   triggers = {
-    main_content_hash         = filesha256("./cloud-functions/onchain-pack-airdrop-monthly-to-sheet/main.py")
-    requirements_content_hash = filesha256("./cloud-functions/onchain-pack-airdrop-monthly-to-sheet/requirements.txt")
-    json_content_hash         = filesha256("./cloud-functions/onchain-pack-airdrop-monthly-to-sheet/bigquery.json")
+    main_content_hash          = filesha256("./cloud-functions/onchain-pack-airdrop-monthly-to-sheet/main.py")
+    requirements_content_hash  = filesha256("./cloud-functions/onchain-pack-airdrop-monthly-to-sheet/requirements.txt")
+    json_content_hash          = filesha256("./cloud-functions/onchain-pack-airdrop-monthly-to-sheet/bigquery.json")
+    sheet_helpers_content_hash = filesha256("./cloud-functions/shared/sheet_helpers.py")
   }
 }
 